@@ -0,0 +1,124 @@
+"""
+Incremental reads of the ActivityWatch buckets (see https://docs.activitywatch.net/en/latest/api/rest.html).
+
+Each bucket is read from a since-cursor, the start time of its newest event seen, so a poll only transfers the
+events since the previous one (the newest event again, as heartbeats extend its duration). The cursors are saved in
+`cursor_path` when they change, so a restarted demo does not re-read the history either. The default `cursor_path` is
+in the user's cache directory, out of the paths watched by the demo.
+"""
+import os
+import json
+import asyncio
+import logging
+from urllib.parse import quote
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import httpx
+
+logger = logging.getLogger('ActiveAgent')
+
+# bucket types read, and the kind of activity they are merged as
+BUCKET_KINDS = {
+    "currentwindow": "window",
+    "afkstatus": "afk",
+    "web.tab.current": "web",
+}
+
+
+def parse_time(timestamp: str) -> datetime:
+    # fromisoformat only accepts 'Z' since python 3.11
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+
+def event_end(event: Dict) -> datetime:
+    return parse_time(event["timestamp"]) + timedelta(seconds = event["duration"])
+
+
+class ActivityWatchClient(object):
+    """
+    Async ActivityWatch client, reusing its HTTP connections across polls.
+
+    Args:
+        base_url (str, optional): The ActivityWatch server. Defaults to `http://127.0.0.1:5600`.
+        cursor_path (str, optional): Where the since-cursors are saved. Defaults to `~/.cache/activeagent/activitywatch.json`.
+        backfill_seconds (float, optional): How far back a bucket without a cursor is read. Defaults to 60 [seconds].
+        limit (int, optional): The maximum number of events read from a bucket in one poll. Defaults to 500.
+    """
+    def __init__(self,
+                base_url: str = "http://127.0.0.1:5600",
+                cursor_path: str = os.path.join(os.path.expanduser('~'), '.cache', 'activeagent', 'activitywatch.json'),
+                backfill_seconds: float = 60,
+                limit: int = 500,
+                timeout: float = 5):
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(
+            base_url = base_url,
+            timeout = timeout,
+            limits = httpx.Limits(max_connections = len(BUCKET_KINDS) + 1, max_keepalive_connections = len(BUCKET_KINDS) + 1))
+        self.cursor_path = cursor_path
+        self.backfill_seconds = backfill_seconds
+        self.limit = limit
+        # bucket id -> kind of activity
+        self.buckets: Dict[str, str] = {}
+        # bucket id -> start time of the newest event read
+        self.cursors: Dict[str, str] = {}
+        if os.path.exists(cursor_path):
+            with open(cursor_path, 'r') as f:
+                self.cursors = json.load(f)
+        self.saved_cursors = dict(self.cursors)
+
+    async def list_buckets(self) -> Dict[str, str]:
+        """
+        Find the buckets to read, returns their ids and kinds.
+        """
+        res = await self.client.get("/api/0/buckets/")
+        res.raise_for_status()
+        self.buckets = {
+            bucket_id: BUCKET_KINDS[bucket["type"]]
+            for bucket_id, bucket in res.json().items() if bucket.get("type") in BUCKET_KINDS}
+        return self.buckets
+
+    async def fetch(self, bucket_id: str) -> List[Dict]:
+        """
+        The events of a bucket since its cursor, oldest first.
+        """
+        start = self.cursors.get(bucket_id)
+        if start is None:
+            start = (datetime.now(timezone.utc) - timedelta(seconds = self.backfill_seconds)).isoformat()
+        res = await self.client.get(
+            f"/api/0/buckets/{quote(bucket_id, safe='')}/events",
+            params = {"start": start, "limit": self.limit})
+        res.raise_for_status()
+        events = sorted(res.json(), key = lambda e: parse_time(e["timestamp"]))
+        if len(events) > 0:
+            self.cursors[bucket_id] = events[-1]["timestamp"]
+        return events
+
+    async def pull(self) -> Dict[str, List[Dict]]:
+        """
+        Read all the buckets concurrently, returns the new events of each kind of activity.
+        """
+        results = await asyncio.gather(*(self.fetch(b) for b in self.buckets), return_exceptions = True)
+        activity: Dict[str, List[Dict]] = {}
+        for bucket_id, result in zip(self.buckets, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to read ActivityWatch bucket {bucket_id}: {result}")
+                continue
+            activity.setdefault(self.buckets[bucket_id], []).extend(result)
+        self.save_cursors()
+        return activity
+
+    def save_cursors(self):
+        if self.cursors == self.saved_cursors:
+            return
+        if os.path.dirname(self.cursor_path):
+            os.makedirs(os.path.dirname(self.cursor_path), exist_ok = True)
+        tmp_path = self.cursor_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.cursors, f)
+        os.replace(tmp_path, self.cursor_path)
+        self.saved_cursors = dict(self.cursors)
+
+    async def aclose(self):
+        await self.client.aclose()
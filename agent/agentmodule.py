@@ -1,9 +1,13 @@
 import os
 import json
+import time
 import logging
 import asyncio
+import inspect
 import requests
-from typing import List, Dict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timezone
 from abc import ABC, abstractmethod
 
@@ -14,7 +18,12 @@ sem = asyncio.Semaphore(16)
 
 from watchdog.observers import Observer
 import tenacity
+from pydantic import ValidationError
 from codelinker import CodeLinker, CodeLinkerConfig
+from capture import Capture, Record, KEY_PRESS, KEY_RELEASE, CLICK
+from filefeed import FileChangeFeed
+from activitywatch import parse_time, event_end
+from register.exceptions import ToolNotFound
 # Load the codelinker.
 default_cfg_file = os.path.join(os.path.dirname(__file__), '..', 'private.toml')
 if not os.path.exists(default_cfg_file):
@@ -149,10 +158,11 @@ class AgentCore(object):
         # concat the event observations.
         # Let the agent summarize the context. Adding it in the new turn.
 
-def read_text_from_file(filepath:str, pages:int = 3) -> str:
+DOCUMENT_EXTS = (".pdf", ".docx", ".txt", ".md")
+
+def read_text_from_file(filepath:str, pages:int = 3, max_bytes:Optional[int] = 64 * 1024) -> str:
+    """Extract the text of the first `pages` pages (paragraphs for docx) of a document, up to `max_bytes` characters."""
     full_path = filepath
-    import time
-    time.sleep(1)
 
     # if not os.path.isfile(full_path):
     #     raise FileNotFoundError(f"File {filepath} not found in workspace.")
@@ -167,7 +177,9 @@ def read_text_from_file(filepath:str, pages:int = 3) -> str:
         content = ''
         for page in reader.pages[:pages]:
             content += page.extract_text()
-        return content
+            if max_bytes is not None and len(content) >= max_bytes:
+                break
+        return content[:max_bytes]
 
     # if filepath.endswith(".pdf"):
     #     import fitz
@@ -185,13 +197,96 @@ def read_text_from_file(filepath:str, pages:int = 3) -> str:
         content = ''
         for para in doc.paragraphs[:pages]:
             content += para.text
-        return content
+            if max_bytes is not None and len(content) >= max_bytes:
+                break
+        return content[:max_bytes]
 
     if filepath.endswith((".txt",".md")):
-        with open(full_path, 'r') as f:
-            content = f.read()
+        # only the head of large files is read
+        with open(full_path, 'r', errors='replace') as f:
+            content = f.read(max_bytes if max_bytes is not None else -1)
         return content
 
+class DocumentExtractor(object):
+    """
+    Extract document texts on a worker pool, cached by (path, mtime, size) with LRU eviction.
+    Concurrent requests of the same document share one extraction.
+    """
+    def __init__(self,
+                max_workers: int = 4,
+                cache_size : int = 128,
+                pages      : int = 3,
+                max_bytes  : Optional[int] = 64 * 1024):
+        self.pool = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'DocumentExtractor')
+        self.cache_size = cache_size
+        self.pages = pages
+        self.max_bytes = max_bytes
+        self.cache: OrderedDict[tuple, str] = OrderedDict()
+        self.pending: Dict[tuple, asyncio.Future] = {}
+        self.background: set = set()
+
+    def key(self, filepath: str) -> tuple:
+        stat = os.stat(filepath)
+        return (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size, self.pages, self.max_bytes)
+
+    async def extract(self, filepath: str) -> str:
+        key = self.key(filepath)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if key not in self.pending:
+            loop = asyncio.get_running_loop()
+            self.pending[key] = loop.run_in_executor(self.pool, read_text_from_file, filepath, self.pages, self.max_bytes)
+        try:
+            content = await asyncio.shield(self.pending[key])
+        finally:
+            self.pending.pop(key, None)
+
+        self.cache[key] = content
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last = False)
+        return content
+
+    def prefetch(self, filepaths: List[str]):
+        """Extract the documents in the background, so they are cached when a proposal needs them."""
+        for filepath in filepaths:
+            if not filepath.endswith(DOCUMENT_EXTS) or not os.path.isfile(filepath):
+                continue
+            task = asyncio.create_task(self.extract(filepath))
+            self.background.add(task)
+            task.add_done_callback(self._prefetched)
+
+    def _prefetched(self, task: asyncio.Task):
+        self.background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f'Failed to pre-extract a document: {task.exception()}')
+
+class Pacer(object):
+    """
+    Adapt the observation interval to the measured LLM latency, so observations are not produced faster than the agent proposes.
+    The interval is `max(base_interval, factor * latency)`, where the latency is an exponential moving average.
+    """
+    def __init__(self,
+                base_interval: float = 15,
+                factor       : float = 1.5,
+                alpha        : float = 0.3,
+                max_interval : Optional[float] = None):
+        self.base_interval = base_interval
+        self.factor = factor
+        self.alpha = alpha
+        self.max_interval = max_interval
+        self.latency: Optional[float] = None
+
+    def record(self, latency: float):
+        self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+
+    @property
+    def interval(self) -> float:
+        if self.latency is None:
+            return self.base_interval
+        interval = max(self.base_interval, self.factor * self.latency)
+        return interval if self.max_interval is None else min(interval, self.max_interval)
+
 class Trigger(ABC):
     """
     A Trigger will be able to receive the content from the agent and pass it to the user.
@@ -217,37 +312,107 @@ class Trigger(ABC):
         pass
 
 
+# special keys typed as text, the others are ignored
+TYPED_KEYS = {'space': ' ', 'enter': '\n', 'tab': '\t'}
+# keys that make a hot-key of the next key pressed
+HOT_KEY_MODIFIERS = {
+    'ctrl': 'ctrl', 'ctrl_l': 'ctrl', 'ctrl_r': 'ctrl',
+    'alt': 'alt', 'alt_l': 'alt', 'alt_r': 'alt',
+    'cmd': 'cmd', 'cmd_l': 'cmd', 'cmd_r': 'cmd',
+}
+
 class ActionListener(object):
     def __init__(self,
                 interval_seconds: int = 10,
-                watched_path:List[str] = []
+                watched_path:List[str] = [],
+                ignore_paths:List[str] = [],
+                max_events: int = 256,
+                max_chars: int = 8192,
+                max_files: int = 32,
                 ):
 
-        # data storages:
-        # Contain the raw events. These events will be filtered and recorded in event_data
-        self.raw_events      :List[Dict] = []
-        self.event_data      :List[Dict] = []
-        # Record the whole string that user typed.(alphabet only now)
-        self.text_content    :str = ""
+        # data storages, bounded so a window of any length takes constant memory:
+        # The filtered events of the current window, the oldest are dropped past `max_events`.
+        self.event_data      :deque = deque(maxlen = max_events)
+        self.hot_keys        :deque = deque(maxlen = max_events)
+        # The characters that user typed, joined when the window is sent. Characters past `max_chars` are dropped.
+        self.text_parts      :List[str] = []
+        self.max_chars       :int = max_chars
+        # the number of mouse clicks of the current window, by button
+        self.clicks          :Dict[str, int] = {}
+        # the modifiers held down, making the next key a hot-key
+        self.modifiers       :set = set()
         self.interval_seconds:int        = interval_seconds
         # Record the time period.
         self.last_post_time:datetime = None
         self.observer = Observer()
-
-
-    def __exit__(self):
-        self.keyboard_listener.stop()
-        self.mouse_listener.stop()
-        self.observer.stop()
+        self.watched_path = watched_path
+        # files written by the agent itself under `watched_path`, they are not user activity
+        self.ignore_paths = ignore_paths
+        self.file_feed:Optional[FileChangeFeed] = None
+        # called in the event loop with the summary of each file change under `watched_path`, see `FileChangeFeed`
+        self.file_callbacks = []
+        # the latest change of each file changed in the current window
+        self.changed_files   :List[Dict] = []
+        self.max_files       :int = max_files
+        # monotonic time of the last user input, None before any input
+        self.last_input_time :Optional[float] = None
+        # set when the current window should be sent before its interval ends (hot-key, file event)
+        self.flush_event = asyncio.Event()
+        self.capture:Optional[Capture] = None
+        # ActivityWatch events of each kind of activity ('window', 'web') by id, and the latest afk status
+        self.activity        :Dict[str, OrderedDict] = {}
+        self.afk_status      :Optional[str] = None
+        # ids of the ActivityWatch events already merged, and the number of new events and afk changes in the window
+        self.seen_activity   :OrderedDict = OrderedDict()
+        self.activity_changes:int = 0
+        self.max_events      :int = max_events
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stop(self):
+        if self.capture is not None:
+            self.capture.stop()
+        if self.observer.is_alive():
+            self.observer.stop()
+
+    @property
+    def text_content(self) -> str:
+        return "".join(self.text_parts)
 
     def reset_data(self):
         """
         reset all the stored data.
         """
         self.event_data.clear()
-        self.text_content = ""
+        self.hot_keys.clear()
+        self.text_parts = []
+        self.clicks = {}
+        self.changed_files = []
+        self.activity_changes = 0
+        self.flush_event.clear()
+
+    def is_idle(self) -> bool:
+        """
+        Whether nothing worth an observation happened in the current window.
+        """
+        return (len(self.event_data) == 0 and len(self.text_parts) == 0 and len(self.clicks) == 0
+                and len(self.changed_files) == 0 and self.activity_changes == 0)
 
-    def send_data(self) -> dict:
+    def is_afk(self, afk_seconds: float) -> bool:
+        return self.last_input_time is None or time.monotonic() - self.last_input_time >= afk_seconds
+
+    def burst_ended(self, gap_seconds: float) -> bool:
+        """
+        Whether the user typed in the current window and stopped for `gap_seconds`.
+        """
+        return len(self.text_parts) > 0 and self.last_input_time is not None and time.monotonic() - self.last_input_time >= gap_seconds
+
+    def send_data(self, afk_seconds: float = 60) -> dict:
         """
         Returns:
             Dict: a event dict containing:
@@ -256,29 +421,43 @@ class ActionListener(object):
                 "duration": (int),
                 "user_input": (str),
                 "hot-keys": List[dict],
+                "clicks": Dict[str, int],
+                "files": List[dict],
                 "status": Literal ['afk'/'not-afk'],
-                "app": (str),
+                "apps": None/List[dict],
                 "info": None/Dict
             },
+            The apps (windows) and the info (web pages) come from ActivityWatch, ranked by the time spent in the window.
         """
         current_time = datetime.now(timezone.utc)
         start_time = self.last_post_time
 
-        # Other apps are now not supported and being ignored.
+        apps = self.summarize_activity('window', ('app', 'title'), start_time, current_time)
+        pages = self.summarize_activity('web', ('url', 'title'), start_time, current_time)
+        if self.afk_status is not None:
+            status = self.afk_status
+        else:
+            status = 'afk' if self.is_afk(afk_seconds) else 'not-afk'
         result_event = {
             "timestamp": start_time.timestamp(),
-            "duration": self.interval_seconds,
+            "duration": round((current_time - start_time).total_seconds()),
             "user_input": self.text_content,
-            "hot-keys": list(filter(lambda x:"hot_key" in x["data"].keys(), self.event_data)), # add those hot keys.
-            "status": None,
-            "apps": None,
-            "info": None
+            "hot-keys": list(self.hot_keys),
+            "clicks": self.clicks,
+            "files": self.changed_files,
+            "status": status,
+            "apps": apps if len(apps) > 0 else None,
+            "info": {"web": pages} if len(pages) > 0 else None
         }
 
         print(result_event)
 
         self.last_post_time = current_time
         self.reset_data()
+        # events still going on are kept for the next window
+        for events in self.activity.values():
+            for key in [key for key, event in events.items() if event_end(event) <= current_time]:
+                del events[key]
 
         # info_str = json.dumps(,ensure_ascii=False)
         return result_event
@@ -290,20 +469,111 @@ class ActionListener(object):
             event (Dict): The filtered event.
         """
         self.event_data.append(event)
+        self.last_input_time = time.monotonic()
+        if "hot_key" in event["data"].keys():
+            self.hot_keys.append(event)
+            self.flush_event.set()
+
+    def push_records(self, records:List[Record]):
+        """
+        Turn the records of the keyboard and mouse capture into typed text, hot-key events and click counts.
+        """
+        for kind, timestamp, key in records:
+            self.last_input_time = timestamp
+            if kind == CLICK:
+                self.clicks[key] = self.clicks.get(key, 0) + 1
+            elif kind == KEY_RELEASE:
+                self.modifiers.discard(HOT_KEY_MODIFIERS.get(key))
+            elif kind == KEY_PRESS:
+                if key in HOT_KEY_MODIFIERS:
+                    self.modifiers.add(HOT_KEY_MODIFIERS[key])
+                elif len(self.modifiers) > 0:
+                    # the character of a key pressed with ctrl may come as a control character
+                    if len(key) == 1 and ord(key) < 32:
+                        key = chr(ord(key) + 96)
+                    self.push_event({"data": {"hot_key": "+".join(sorted(self.modifiers) + [key])}})
+                elif key == 'backspace':
+                    if len(self.text_parts) > 0:
+                        self.text_parts.pop()
+                elif len(self.text_parts) < self.max_chars:
+                    char = key if len(key) == 1 else TYPED_KEYS.get(key)
+                    if char is not None:
+                        self.text_parts.append(char)
+
+    def push_activity(self, kind:str, events:List[Dict]):
+        """
+        Merge ActivityWatch events, oldest first, into the current window. See `ActivityWatchClient.pull`.
+        """
+        if kind == 'afk':
+            if len(events) > 0:
+                status = events[-1]["data"].get("status")
+                if self.afk_status is not None and status != self.afk_status:
+                    self.activity_changes += 1
+                self.afk_status = status
+            return
+        bucket = self.activity.setdefault(kind, OrderedDict())
+        for event in events:
+            # heartbeats extend the latest event, it is read again with the same id
+            key = event.get("id", event["timestamp"])
+            bucket[key] = event
+            bucket.move_to_end(key)
+            if len(bucket) > self.max_events:
+                bucket.popitem(last = False)
+            # a new window or web page is activity, e.g. a user who only reads and switches tabs
+            if (kind, key) not in self.seen_activity:
+                self.seen_activity[(kind, key)] = True
+                self.activity_changes += 1
+                if len(self.seen_activity) > 4 * self.max_events:
+                    self.seen_activity.popitem(last = False)
+
+    def summarize_activity(self, kind:str, keys:Tuple[str, ...], start:datetime, end:datetime, top:int = 5) -> List[Dict]:
+        """
+        The `top` values of the `keys` of the events of `kind`, by time spent in them between `start` and `end`.
+        """
+        durations = {}
+        for event in self.activity.get(kind, {}).values():
+            seconds = (min(event_end(event), end) - max(parse_time(event["timestamp"]), start)).total_seconds()
+            if seconds <= 0:
+                continue
+            value = tuple(event["data"].get(k) for k in keys)
+            durations[value] = durations.get(value, 0) + seconds
+        ranked = sorted(durations.items(), key = lambda x: x[1], reverse = True)[:top]
+        return [{**dict(zip(keys, value)), "duration": round(seconds)} for value, seconds in ranked]
+
+    def push_file(self, change:Dict):
+        """
+        Record a file change under `watched_path`, to be called in the event loop.
+        Args:
+            change (Dict): The change summary, with the keys `path`, `change` and `size`.
+        """
+        self.changed_files = [c for c in self.changed_files if c["path"] != change["path"]]
+        self.changed_files.append(change)
+        if len(self.changed_files) > self.max_files:
+            self.changed_files.pop(0)
+        self.flush_event.set()
+        for callback in self.file_callbacks:
+            callback(change)
 
     def start(self):
         """
         Start the listener.
         Note the timezone of our data is UTC.
         """
+        loop = asyncio.get_running_loop()
+        self.file_feed = FileChangeFeed(self.push_file, loop, ignore_paths = self.ignore_paths)
+        for path in self.watched_path:
+            self.observer.schedule(self.file_feed, path, recursive = True)
         self.observer.start()
+        self.capture = Capture(self.push_records, loop)
+        self.capture.start()
         self.last_post_time = datetime.now(timezone.utc)
 
 class Executor(Trigger):
     '''
     This compoment will execute some actions based on the agent's result.
+    Tools are called in-process from the `ToolRegister`, or through the tool server (`main.py`) if `remote_url` is given.
     '''
-    def __init__(self):
+    def __init__(self, toolreg = None, remote_url: Optional[str] = None, extractor: Optional[DocumentExtractor] = None):
 
         config = codelinker_config.get_apiconfig_by_model('activeagent')
 
@@ -314,61 +584,84 @@ class Executor(Trigger):
         except:
             self.base_url = None
 
+        if toolreg is None and remote_url is None:
+            from register import ToolRegister
+            toolreg = ToolRegister()
+        self.toolreg = toolreg
+        self.remote_url = remote_url
+        self.extractor = extractor if extractor is not None else DocumentExtractor()
+
     def receive(self, response:Dict, exec_args:Dict):
 
         self.response = response
         self.exec_args = exec_args
 
-    def send(self):
-        # The original response from the agent.
-        response = self.response
-        # The args including the event and the tool call format.
-        action_labels = self.exec_args
-
- 
-        def activated_callback():
-            print('>' * 80)
-            global status
-            status = 'The user accepts the last proposal from you.'
-            infos = self.exec_args
-            func_call_str = infos['func_call']
-            # parsing the arguments into function name and parameters
-            func_infos = func_call_str.split('&')
-            # Get the function name.
-            func_name = func_infos[0]
-            # Get the parameters as a dictionary.
-            func_params = {k:v for k,v in (param.split('=') for param in func_infos[1:])}
-            # For the chat (completion) function, add the api_key and base_url.
-
-            logger.debug(f'Function name {func_name}; Function origin params {func_params}.')
-
-            match func_name:
-                case 'search':
-                    response = requests.get(f'http://127.0.0.1:8000/{func_name}',params=func_params)
-                    response = response.json()
-                # For chat we will update the api config and the backgrounds to the params.
-                case 'chat':
-                    func_params.update({
-                        'api_key' : self.api_key,
-                        'base_url': self.base_url,
-                        'messages': json.dumps(infos["events"])})
-
-                    response = requests.get(f'http://127.0.0.1:8000/{func_name}',params=func_params)
-                    response = response.json()
-                # For read, we simply pass it.
-                case 'read':
-                    response = requests.get(f'http://127.0.0.1:8000/{func_name}',params=func_params)
-                    response = response.json()
-                    # TODO: Need a update.
-                    if response['status'] == 'success':
-                        prompt = \
+    @staticmethod
+    def parse_func_call(func_call_str: str) -> Tuple[str, Dict[str, str]]:
+        """Parse a tool call string `name&key=value&...` into the function name and parameters."""
+        func_infos = func_call_str.split('&')
+        func_params = {k:v for k,v in (param.split('=', 1) for param in func_infos[1:])}
+        return func_infos[0], func_params
+
+    async def call(self, func_name: str, func_params: Dict) -> Dict:
+        """Call a tool with its string parameters and return the status dict."""
+        if self.remote_url is not None:
+            response = await asyncio.to_thread(requests.get, f'{self.remote_url}/{func_name}', params=func_params)
+            return response.json()
+
+        try:
+            tool = self.toolreg[func_name]
+            args = tool.tool_labels.args_model.model_validate(func_params)
+        except (ToolNotFound, ValidationError) as e:
+            return {'status': 'error', 'message': str(e)}
+
+        try:
+            if inspect.iscoroutinefunction(tool):
+                res = await tool(**args.model_dump())
+            else:
+                # blocking tools run in a thread, so they do not stall the agent loop
+                res = await asyncio.to_thread(tool, **args.model_dump())
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+        # plain results are wrapped like the tool server does
+        return res if isinstance(res, dict) else {'status': 'success', 'content': res}
+
+    async def send(self) -> Dict:
+        infos = self.exec_args
+        func_name, func_params = self.parse_func_call(infos['func_call'])
+
+        logger.debug(f'Function name {func_name}; Function origin params {func_params}.')
+
+        match func_name:
+            # For chat we will update the api config and the backgrounds to the params.
+            case 'chat':
+                func_params.update({
+                    'api_key' : self.api_key,
+                    'base_url': self.base_url,
+                    'messages': json.dumps(infos["events"])})
+                response = await self.call(func_name, func_params)
+            case 'read':
+                filepath = func_params.get('filepath', '')
+                if filepath.endswith(('.pdf', '.docx')):
+                    # documents are extracted (usually pre-extracted) by the extractor instead of read as text
+                    try:
+                        response = {'status': 'success', 'content': await self.extractor.extract(filepath)}
+                    except Exception as e:
+                        response = {'status': 'error', 'message': str(e)}
+                else:
+                    response = await self.call(func_name, func_params)
+                # TODO: Need a update.
+                if response['status'] == 'success':
+                    prompt = \
 """You are a helpful assistant, currently you are dealing with contents in a file.
 Here is the background {target}.
 Here is the content of the file: {content}
 Please accomplish the proposal raised by the agent.""".format(target = infos, content = response['content'])
 
-                        new_params = {'api_key':self.api_key, 'base_url':self.base_url, 'messages':prompt}
-                        __ = requests.get('http://127.0.0.1:8000/chat',params = new_params)
+                    new_params = {'api_key':self.api_key, 'base_url':self.base_url, 'messages':prompt}
+                    await self.call('chat', new_params)
+            case _:
+                response = await self.call(func_name, func_params)
 
-        # Propose the candidates to choose.
-        print('What wrong for proposal?')
+        logger.debug(f'Function {func_name} returns {response}.')
+        return response
@@ -0,0 +1,134 @@
+"""
+Keyboard and mouse capture.
+
+The pynput listeners run on their own threads. Each one pushes fixed-size `(kind, time, key)` records into its own
+bounded ring buffer and schedules a drain in the event loop, where the records are handed to the `ActionListener`.
+Memory stays constant however long the session is, records pushed into a full buffer are dropped and counted.
+"""
+import time
+import asyncio
+import logging
+import heapq
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger('ActiveAgent')
+
+# record kinds
+KEY_PRESS = 0
+KEY_RELEASE = 1
+CLICK = 2
+
+Record = Tuple[int, float, str]
+
+
+class RingBuffer(object):
+    """
+    Single-producer single-consumer ring buffer of fixed capacity.
+    The producer only writes `tail` and the consumer only writes `head`, so no lock is needed.
+    """
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.slots: List[Optional[Record]] = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def push(self, record: Record) -> bool:
+        if self.tail - self.head >= self.capacity:
+            self.dropped += 1
+            return False
+        self.slots[self.tail % self.capacity] = record
+        self.tail += 1
+        return True
+
+    def pop_all(self) -> List[Record]:
+        tail = self.tail
+        records = [self.slots[i % self.capacity] for i in range(self.head, tail)]
+        self.head = tail
+        return records
+
+
+def key_name(key) -> str:
+    """
+    A short name of a pynput key: the character for printable keys, the name (e.g. `ctrl_l`) for special keys.
+    """
+    char = getattr(key, 'char', None)
+    if char is not None:
+        return char
+    name = getattr(key, 'name', None)
+    if name is not None:
+        return name
+    return f"<{getattr(key, 'vk', '')}>"
+
+
+class Capture(object):
+    """
+    Run the pynput keyboard and mouse listeners and drain their records into `callback` in the event loop.
+
+    Args:
+        callback (Callable): Called in the event loop with the records captured since the last drain, in time order.
+        loop (asyncio.AbstractEventLoop): The event loop to drain into.
+        capacity (int, optional): Capacity of each ring buffer. Defaults to 4096.
+    """
+    def __init__(self, callback: Callable[[List[Record]], None], loop: asyncio.AbstractEventLoop, capacity: int = 4096):
+        self.callback = callback
+        self.loop = loop
+        self.keyboard = RingBuffer(capacity)
+        self.mouse = RingBuffer(capacity)
+        # a drain is already scheduled, so producers don't schedule one per record
+        self.scheduled = False
+        self.listeners = []
+
+    def schedule(self):
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon_threadsafe(self.drain)
+
+    def drain(self):
+        self.scheduled = False
+        records = list(heapq.merge(self.keyboard.pop_all(), self.mouse.pop_all(), key=lambda r: r[1]))
+        if len(records) > 0:
+            self.callback(records)
+
+    def on_press(self, key):
+        self.keyboard.push((KEY_PRESS, time.monotonic(), key_name(key)))
+        self.schedule()
+
+    def on_release(self, key):
+        self.keyboard.push((KEY_RELEASE, time.monotonic(), key_name(key)))
+        self.schedule()
+
+    def on_click(self, x, y, button, pressed):
+        if pressed:
+            self.mouse.push((CLICK, time.monotonic(), button.name))
+            self.schedule()
+
+    @property
+    def dropped(self) -> int:
+        return self.keyboard.dropped + self.mouse.dropped
+
+    def start(self) -> bool:
+        """
+        Start the listeners, returns False if pynput is not available (e.g. no display).
+        """
+        try:
+            from pynput import keyboard, mouse
+        except ImportError as e:
+            logger.warning(f"Keyboard and mouse capture disabled: {e}")
+            return False
+        self.listeners = [
+            keyboard.Listener(on_press = self.on_press, on_release = self.on_release),
+            mouse.Listener(on_click = self.on_click),
+        ]
+        for listener in self.listeners:
+            listener.daemon = True
+            listener.start()
+        return True
+
+    def stop(self):
+        for listener in self.listeners:
+            listener.stop()
+        self.listeners = []
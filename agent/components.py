@@ -5,6 +5,7 @@ This file provide three distinct components:
 '''
 import os
 import json
+import time
 import asyncio
 import logging
 import threading
@@ -12,12 +13,14 @@ import subprocess
 from typing import Iterable, Literal, Optional, Dict, List
 
 import colorlog
+import httpx
 from codelinker import CodeLinker, CodeLinkerConfig, EventProcessor, EventSink
 from codelinker.models import SEvent, ChannelTag
 
 
 from channels import sc
-from agentmodule import ActionListener, Executor
+from agentmodule import ActionListener, Executor, DocumentExtractor, Pacer
+from activitywatch import ActivityWatchClient
 from prompt import SYSTEM_PROMPT
 from constant import AgentResponse
 
@@ -94,20 +97,53 @@ class DemoEnv(BasicComponent):
                 interval_seconds:int = 15,
                 watched_path:List[str] = [],
                 name:str = 'DemoEnv',
+                pacer:Optional[Pacer] = None,
+                burst_gap_seconds:float = 2,
+                min_interval_seconds:float = 2,
+                afk_seconds:float = 60,
+                activitywatch_url:Optional[str] = None,
+                activitywatch_poll_seconds:float = 5,
                 ):
         """
         Args:
-            interval_seconds (int, optional): The pause time between two interactions. Defaults to 15 [seconds].
+            interval_seconds (int, optional): The maximum length of an observation window. Defaults to 15 [seconds].
             name (str, optional): the name of the environment. Defaults to 'DemoEnv'.
+            pacer (Pacer, optional): Stretch the interval to the agent's proposal latency. Defaults to a fixed interval.
+            burst_gap_seconds (float, optional): A typing pause this long ends the window early. Defaults to 2 [seconds].
+            min_interval_seconds (float, optional): The minimum length of a window ended early. Defaults to 2 [seconds].
+            afk_seconds (float, optional): The user is away after this long without input. Defaults to 60 [seconds].
+            activitywatch_url (str, optional): Read the window, afk and web buckets of this ActivityWatch server. Defaults to None.
+            activitywatch_poll_seconds (float, optional): The pause between two reads of the buckets. Defaults to 5 [seconds].
         """
         super().__init__(name)
         self.interval_seconds = interval_seconds
-
+        self.pacer = pacer if pacer is not None else Pacer(base_interval = interval_seconds, factor = 0)
+        self.burst_gap_seconds = burst_gap_seconds
+        self.min_interval_seconds = min_interval_seconds
+        self.afk_seconds = afk_seconds
+        # windows sent as observations, ended early, and suppressed (i.e. the LLM calls avoided)
+        self.window_stats = {"observations": 0, "early": 0, "suppressed": 0}
+
+        self.activitywatch = ActivityWatchClient(base_url = activitywatch_url) if activitywatch_url is not None else None
+        self.activitywatch_poll_seconds = activitywatch_poll_seconds
+
+        # the saved completions, reflections and cursors of the agent would trigger observations of their own
+        ignore_paths = [codelinker_config.request.save_completions_path, os.path.abspath('reflect.json')]
+        if self.activitywatch is not None:
+            ignore_paths.append(self.activitywatch.cursor_path)
         self.action_listener = ActionListener(
             interval_seconds = interval_seconds,
-            watched_path=watched_path)
-
-        self.executor = Executor()
+            watched_path=watched_path,
+            ignore_paths=ignore_paths)
+
+        # tools are called in-process unless REMOTE_TOOLS is set, then they go through the tool server (`main.py`)
+        self.remote_tools = os.environ.get("REMOTE_TOOLS","False") == "True"
+        # documents under the watched paths are extracted in the background when they change
+        self.extractor = DocumentExtractor()
+        self.executor = Executor(
+            toolreg = toolreg,
+            extractor = self.extractor,
+            remote_url = os.environ.get("TOOL_SERVER_URL","http://127.0.0.1:8080") if self.remote_tools else None)
 
         complete_tools = toolreg.get_all_tools_dict()
         self.tools = [t for t in complete_tools if 'android' not in t["name"]]
@@ -116,34 +152,91 @@ class DemoEnv(BasicComponent):
     async def setup(self):
         self.logger.info("Initializing Demo Environment...")
 
-        def start_local_server():
-            try:
-                subprocess.run(['python', 'main.py'])
-            except:
-                subprocess.run(['python3', 'main.py'])
+        if self.remote_tools:
+            def start_local_server():
+                try:
+                    subprocess.run(['python', 'main.py'])
+                except:
+                    subprocess.run(['python3', 'main.py'])
 
-        # We set up the uvicorn in another thread, so we don't have to open to terminal.
-        self.thread = threading.Thread(target = start_local_server, daemon=True)
-        self.thread.start()
-        self.logger.info("Local server established.")
+            # We set up the uvicorn in another thread, so we don't have to open to terminal.
+            self.thread = threading.Thread(target = start_local_server, daemon=True)
+            self.thread.start()
+            self.logger.info("Local server established.")
 
         self.add(sc.agent.operations, content = json.dumps(self.tools), silent = True)
         self.listen(sc.demo.notify)(self.execute)
+        def prefetch(change:Dict):
+            if change["change"] != 'deleted':
+                self.extractor.prefetch([change["path"]])
+        self.action_listener.file_callbacks.append(prefetch)
         self.action_listener.start()
-        read_task = asyncio.create_task(self.read_data())
+        tasks = [asyncio.create_task(self.read_data())]
+        if self.activitywatch is not None:
+            try:
+                buckets = await self.activitywatch.list_buckets()
+                self.logger.info(f"Reading buckets from: {', '.join(buckets)}")
+                tasks.append(asyncio.create_task(self.sync_activity()))
+            except httpx.HTTPError as e:
+                self.logger.warning(f"ActivityWatch is not available at {self.activitywatch.base_url}: {e}")
         self.logger.info("Demo Environment Initialized. Action Listener running...")
 
-        await asyncio.gather(read_task)
+        await asyncio.gather(*tasks)
 
-    async def read_data(self):
+    async def sync_activity(self):
+        """
+        Merge the new ActivityWatch events into the action listener's window.
+        """
+        while True:
+            for kind, events in (await self.activitywatch.pull()).items():
+                self.action_listener.push_activity(kind, events)
+            await asyncio.sleep(self.activitywatch_poll_seconds)
 
-        await asyncio.sleep(self.interval_seconds)
+    async def read_data(self):
+        """
+        Send the user's activity as observations. A window ends after the (paced) interval, or early when a typing
+        burst ends or a hot-key or file event happens. Windows without activity are not sent, they are merged into the
+        next one, so an idle user costs no LLM call.
+        """
+        listener = self.action_listener
+        loop = asyncio.get_running_loop()
+        window_start = loop.time()
 
         while True:
-            data:Dict = self.action_listener.send_data()
+            # back off while the agent is slower than the interval
+            interval = self.pacer.interval
+            listener.interval_seconds = interval
+            elapsed = loop.time() - window_start
+            if listener.flush_event.is_set():
+                await asyncio.sleep(max(self.min_interval_seconds - elapsed, 0))
+            else:
+                try:
+                    await asyncio.wait_for(listener.flush_event.wait(),
+                                           timeout = max(min(interval - elapsed, self.burst_gap_seconds / 2), 0))
+                except asyncio.TimeoutError:
+                    pass
+
+            elapsed = loop.time() - window_start
+            early = elapsed >= self.min_interval_seconds and (
+                listener.flush_event.is_set() or listener.burst_ended(self.burst_gap_seconds))
+            if not early and elapsed < interval:
+                continue
+            window_start = loop.time()
+
+            if listener.is_idle():
+                # nothing to observe, keep the window open until something happens
+                listener.flush_event.clear()
+                self.window_stats["suppressed"] += 1
+                self.logger.debug(f"Idle window suppressed: {self.window_stats}")
+                continue
+
+            data:Dict = listener.send_data(afk_seconds = self.afk_seconds)
+            self.window_stats["observations"] += 1
+            if early and elapsed < interval:
+                self.window_stats["early"] += 1
             async with self.get_tag_lock(sc.activity):
                 self.add(sc.observation, content = json.dumps(data,ensure_ascii=False))
-            await asyncio.sleep(self.interval_seconds)
+            self.logger.debug(f"Observation windows: {self.window_stats}")
 
     async def execute(self):
         operation:str = self.get(sc.agent.execute).content
@@ -157,16 +250,27 @@ class DemoEnv(BasicComponent):
 
         exec_args = {"events": current_event, "func_call": operation}
         self.executor.receive(proposal_json, exec_args)
-        self.executor.send()
+        await self.executor.send()
 
 class DemoAgent(BasicComponent):
     def __init__(self,*,
-                name:str = "ActiveAgent"):
+                name:str = "ActiveAgent",
+                interval_seconds:int = 15,
+                cancel_stale:bool = False):
         """
         Args:
             name (str, optional): The name of the agent. Defaults to "ActiveAgent".
+            interval_seconds (int, optional): The base interval of the observations, see `Pacer`. Defaults to 15 [seconds].
+            cancel_stale (bool, optional): Cancel the in-flight proposal when a newer observation arrives. Defaults to False.
         """
         super().__init__(name)
+        self.pacer = Pacer(base_interval = interval_seconds)
+        self.cancel_stale = cancel_stale
+        # an observation arrived that is not part of a proposal yet
+        self.pending = False
+        self.proposing:Optional[asyncio.Task] = None
+        # the in-flight proposal was cancelled for a newer observation, not by a shutdown
+        self._superseded = False
 
     @property
     def memory(self):
@@ -178,12 +282,27 @@ class DemoAgent(BasicComponent):
         logger.info("Agent setup done.")
 
     async def propose(self):
-
-        if self.get_tag_lock(sc.agent.propose).locked():
-            logger.error("Another agent is proposing.")
+        # latest wins: observations that arrive while a proposal is in flight are merged into the next proposal
+        self.pending = True
+        if self.proposing is not None and not self.proposing.done():
+            if self.cancel_stale and self.proposing.cancel():
+                self._superseded = True
             return
 
+        while self.pending:
+            self.pending = False
+            self.proposing = asyncio.create_task(self.make_proposal())
+            try:
+                await self.proposing
+            except asyncio.CancelledError:
+                if not self._superseded:
+                    raise
+                self._superseded = False
+                logger.info("The proposal is superseded by a newer observation.")
+
+    async def make_proposal(self):
         async with self.get_tag_lock(sc.agent.propose):
+            # the activity lock is only held while gathering, so new observations are not blocked by the LLM call
             async with self.get_tag_lock(sc.activity):
 
                 ops_event:SEvent = self.get(sc.agent.operations)
@@ -200,21 +319,24 @@ class DemoAgent(BasicComponent):
                     "operations": ops
                 })
 
-                logger.debug('Start Proposing....')
+            logger.debug('Start Proposing....')
 
-                res: AgentResponse = await self.cl.exec(
-                    prompt = user_content,
-                    return_type = AgentResponse,
-                    messages = self.memory + history,
-                )
+            start = time.perf_counter()
+            res: AgentResponse = await self.cl.exec(
+                prompt = user_content,
+                return_type = AgentResponse,
+                messages = self.memory + history,
+            )
+            self.pacer.record(time.perf_counter() - start)
+            logger.debug(f'Proposal latency {time.perf_counter() - start:.2f}s, observation interval {self.pacer.interval:.2f}s.')
 
-                self.logger.info(res)
-                self.add(sc.agent.propose, content = res.model_dump_json())
+            self.logger.info(res)
+            self.add(sc.agent.propose, content = res.model_dump_json())
 
-                if res.Operation is not None and res.Operation != 'null':
-                    self.add(sc.agent.execute, res.Operation)
-                else:
-                    self.add(sc.agent.execute, "nop")
+            if res.Operation is not None and res.Operation != 'null':
+                self.add(sc.agent.execute, res.Operation)
+            else:
+                self.add(sc.agent.execute, "nop")
 
 class Trigger(BasicComponent):
     def __init__(self,*,
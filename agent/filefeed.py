@@ -0,0 +1,130 @@
+"""
+File changes under the watched paths, as compact summaries for the observations.
+
+The watchdog observer thread only hands the raw events to the event loop. There, the events of a path are debounced
+(e.g. the burst of events of an editor save) and settled into one change once the path has been quiet for
+`debounce_seconds`. A change whose content fingerprint did not change (a no-op save) is dropped.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from fnmatch import fnmatch
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from watchdog.events import FileSystemEventHandler
+
+logger = logging.getLogger('ActiveAgent')
+
+# a path with any component matching one of these is ignored
+DEFAULT_IGNORES = [
+    '.git', '.hg', '.svn', '__pycache__', 'node_modules', '.venv', '.idea', '.vscode', '.cache',
+    '*.pyc', '*.swp', '*.swx', '*~', '.#*', '*.tmp', '.DS_Store',
+]
+# bytes hashed at the start and at the end of a file
+FINGERPRINT_SAMPLE = 64 * 1024
+# number of files whose fingerprint is kept
+FINGERPRINT_CACHE_SIZE = 4096
+
+
+def fingerprint(path: str) -> Optional[Tuple[int, str]]:
+    """
+    The size and a hash of the first and last `FINGERPRINT_SAMPLE` bytes of a file, None if it does not exist.
+    """
+    try:
+        size = os.path.getsize(path)
+        h = hashlib.blake2b(digest_size = 16)
+        with open(path, 'rb') as f:
+            h.update(f.read(FINGERPRINT_SAMPLE))
+            if size > 2 * FINGERPRINT_SAMPLE:
+                f.seek(-FINGERPRINT_SAMPLE, os.SEEK_END)
+                h.update(f.read(FINGERPRINT_SAMPLE))
+    except (FileNotFoundError, IsADirectoryError, PermissionError):
+        return None
+    return size, h.hexdigest()
+
+
+class FileChangeFeed(FileSystemEventHandler):
+    """
+    Watchdog handler calling `callback` in the event loop with a summary of each settled change:
+    `{"path": str, "change": "created"/"modified"/"deleted", "size": int/None}`.
+
+    Args:
+        callback (Callable): Called in the event loop with the change summaries.
+        loop (asyncio.AbstractEventLoop): The event loop the changes are settled in.
+        debounce_seconds (float, optional): How long a path has to be quiet before its change is settled. Defaults to 0.5.
+        ignore (List[str], optional): fnmatch patterns of the path components to ignore. Defaults to `DEFAULT_IGNORES`.
+        ignore_paths (List[str], optional): Files or directories to ignore, e.g. those written by the agent itself. Defaults to [].
+    """
+    def __init__(self,
+                callback: Callable[[Dict], None],
+                loop: asyncio.AbstractEventLoop,
+                debounce_seconds: float = 0.5,
+                ignore: List[str] = DEFAULT_IGNORES,
+                ignore_paths: List[str] = []):
+        super().__init__()
+        self.callback = callback
+        self.loop = loop
+        self.debounce_seconds = debounce_seconds
+        self.ignore = ignore
+        self.ignore_paths = [os.path.abspath(p) for p in ignore_paths]
+        # the first event of each unsettled path, and its debounce timer
+        self.pending: Dict[str, str] = {}
+        self.timers: Dict[str, asyncio.TimerHandle] = {}
+        self.fingerprints: OrderedDict[str, Tuple[int, str]] = OrderedDict()
+        self.stats = {"events": 0, "ignored": 0, "changes": 0, "unchanged": 0}
+
+    def is_ignored(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        if any(path == p or path.startswith(p + os.sep) for p in self.ignore_paths):
+            return True
+        return any(fnmatch(part, pattern) for part in path.split(os.sep) if part for pattern in self.ignore)
+
+    def on_any_event(self, event):
+        # in the observer thread
+        if event.is_directory:
+            return
+        if event.event_type == 'moved':
+            self.loop.call_soon_threadsafe(self.note, event.src_path, 'deleted')
+            self.loop.call_soon_threadsafe(self.note, event.dest_path, 'created')
+        elif event.event_type in ('created', 'modified', 'deleted'):
+            self.loop.call_soon_threadsafe(self.note, event.src_path, event.event_type)
+
+    def note(self, path: str, event_type: str):
+        self.stats["events"] += 1
+        if self.is_ignored(path):
+            self.stats["ignored"] += 1
+            return
+        self.pending.setdefault(path, event_type)
+        if path in self.timers:
+            self.timers[path].cancel()
+        self.timers[path] = self.loop.call_later(
+            self.debounce_seconds, lambda: asyncio.ensure_future(self.settle(path)))
+
+    async def settle(self, path: str):
+        first = self.pending.pop(path)
+        self.timers.pop(path)
+        fp = await asyncio.to_thread(fingerprint, path)
+        if path in self.pending:
+            # changed again while fingerprinting, settled later
+            self.pending[path] = first
+            return
+        previous = self.fingerprints.pop(path, None)
+        if fp is not None:
+            self.fingerprints[path] = fp
+            if len(self.fingerprints) > FINGERPRINT_CACHE_SIZE:
+                self.fingerprints.popitem(last = False)
+
+        if fp is not None and fp == previous or fp is None and previous is None and first == 'created':
+            # a no-op save, or a temporary file created and deleted in the same burst
+            self.stats["unchanged"] += 1
+            return
+        if fp is None:
+            change = 'deleted'
+        elif previous is not None or first != 'created':
+            change = 'modified'
+        else:
+            change = 'created'
+        self.stats["changes"] += 1
+        self.callback({"path": path, "change": change, "size": fp[0] if fp is not None else None})
@@ -72,14 +72,17 @@ async def chat(messages: str, api_key:str = "", model:Optional[str] = "gpt-3.5-t
     return await toolreg["chat"](messages, api_key = api_key, model = model, base_url = base_url)
 
 @app.get('/read')
-async def read(filepath: str, line_number: int = 1) -> Dict[str,str]:
+async def read(filepath: str, line_number: int = 1, num_lines: int = 200, byte_offset: Optional[int] = None, max_bytes: int = 16 * 1024) -> Dict[str,str]:
     """
     Read the file in `filepath`, start from `line_number`.
-    This function will call the read tool, and return the content read.
+    This function will call the read tool, and return the content read. Details in register/tools/file.py
 
     Args:
         filepath (str): Absolute path from workspace root.
         line_number (int, optional): Starting line number; supports negative values for reverse indexing.. Defaults to 1.
+        num_lines (int, optional): Maximum number of lines to read. Defaults to 200.
+        byte_offset (int, optional): Read from this byte offset instead of by lines. Defaults to None.
+        max_bytes (int, optional): Maximum number of bytes to read. Defaults to 16384.
 
     Returns:
         Dict[str,str]
@@ -88,7 +91,7 @@ async def read(filepath: str, line_number: int = 1) -> Dict[str,str]:
     """
     try:
         # print(filepath, line_number)
-        content = toolreg["read"](filepath, line_number)
+        content = toolreg["read"](filepath, line_number, num_lines, byte_offset, max_bytes)
         # print('>', content)
         return {'status': 'success', 'content': content}
     except Exception as e:
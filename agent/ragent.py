@@ -27,14 +27,15 @@ f'''
 Socket Configuration:
 - Activity port: {port}.
 - Assistance Interval: {interval} seconds.
-- Reading buckets from:
 '''
     logger.info(CONFIG_INFO)
 
-    agent = DemoAgent(name = 'Demo Agent')
+    agent = DemoAgent(name = 'Demo Agent', interval_seconds = interval)
     env = DemoEnv(
                 interval_seconds = interval,
-                watched_path=[os.path.abspath('.')])
+                watched_path=[os.path.abspath('.')],
+                pacer = agent.pacer,
+                activitywatch_url = f"http://127.0.0.1:{port}")
     trigger = Trigger()
     eventSink.init()
 
@@ -1,6 +1,9 @@
 from ..wrapper import toolwrapper
-from openai import OpenAI
+from openai import AsyncOpenAI
+import asyncio
+import time
 import pyperclip
+from collections import OrderedDict
 
 from typing import Optional
 
@@ -9,6 +12,27 @@ If the assistant ask you to generate code, you should only generate code without
 {infos}
 """
 
+# one client per (base_url, api_key), so the connections are reused across calls
+_clients: dict[tuple, AsyncOpenAI] = {}
+# the latest responses of identical (base_url, model, prompt) requests
+_responses: OrderedDict[tuple, str] = OrderedDict()
+CACHE_SIZE = 64
+# minimum seconds between two clipboard updates while streaming
+CLIPBOARD_INTERVAL = 0.2
+
+
+def get_client(api_key: str, base_url: Optional[str]) -> AsyncOpenAI:
+    key = (base_url, api_key)
+    if key not in _clients:
+        _clients[key] = AsyncOpenAI(api_key = api_key, base_url = base_url)
+    return _clients[key]
+
+
+async def copy(text: str):
+    # pyperclip calls the system clipboard tools, keep it off the event loop
+    await asyncio.to_thread(pyperclip.copy, text)
+
+
 @toolwrapper(name="chat",visible=True)
 async def chat(messages: str = "Who are you?",
                 api_key :str = "",
@@ -27,19 +51,38 @@ async def chat(messages: str = "Who are you?",
         dict: whether the function is successful or not.
     """
     print('====>', messages)
-    client = OpenAI(api_key = api_key, base_url = base_url)
-    response = client.chat.completions.create(
-        model=model,
-        messages = [{"role": "user", "content": BASIC_PROMPT.format(infos=messages)}]
-    )
-    # print(response.choices[0].message.content)
+    prompt = BASIC_PROMPT.format(infos=messages)
+    key = (base_url, model, prompt)
     try:
-        pyperclip.copy(response.choices[0].message.content)
+        if key in _responses:
+            _responses.move_to_end(key)
+            await copy(_responses[key])
+            return {'status': 'success'}
+
+        stream = await get_client(api_key, base_url).chat.completions.create(
+            model=model,
+            messages = [{"role": "user", "content": prompt}],
+            stream=True,
+        )
+        # the clipboard is filled while the response is generated
+        content = ''
+        last_copy = time.monotonic()
+        async for chunk in stream:
+            if len(chunk.choices) == 0 or not chunk.choices[0].delta.content:
+                continue
+            content += chunk.choices[0].delta.content
+            if time.monotonic() - last_copy >= CLIPBOARD_INTERVAL:
+                await copy(content)
+                last_copy = time.monotonic()
+        await copy(content)
+
+        _responses[key] = content
+        if len(_responses) > CACHE_SIZE:
+            _responses.popitem(last=False)
         return {'status': 'success'}
     except Exception as e:
         print(str(e))
         return {'status': 'error', 'message': str(e)}
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(chat("Who are you?"))
@@ -0,0 +1,94 @@
+import os
+import mmap
+import bisect
+from collections import OrderedDict
+from typing import Optional
+from ..wrapper import toolwrapper
+
+# a checkpoint (line number, line start offset) is kept about every `INDEX_STRIDE` bytes of a file
+INDEX_STRIDE = 64 * 1024
+# number of files whose line index is kept
+INDEX_CACHE_SIZE = 32
+
+_indexes: OrderedDict[str, tuple] = OrderedDict()
+
+
+def build_index(mm: mmap.mmap) -> tuple[list[int], list[int], int]:
+    """Sparse line index of a file: the line numbers and start offsets of the checkpoints, and the total number of lines."""
+    lines, offsets = [0], [0]
+    count = 0
+    pos = 0
+    size = len(mm)
+    while pos < size:
+        end = mm.find(b'\n', min(pos + INDEX_STRIDE, size) - 1)
+        end = size if end == -1 else end + 1
+        count += mm[pos:end].count(b'\n')
+        pos = end
+        if pos < size:
+            lines.append(count)
+            offsets.append(pos)
+    total = count + (1 if size > 0 and mm[size - 1:size] != b'\n' else 0)
+    return lines, offsets, total
+
+
+def get_index(filepath: str, mm: mmap.mmap) -> tuple[list[int], list[int], int]:
+    stat = os.stat(filepath)
+    key = os.path.abspath(filepath)
+    if key in _indexes and _indexes[key][0] == (stat.st_mtime_ns, stat.st_size):
+        _indexes.move_to_end(key)
+        return _indexes[key][1]
+    index = build_index(mm)
+    _indexes[key] = ((stat.st_mtime_ns, stat.st_size), index)
+    if len(_indexes) > INDEX_CACHE_SIZE:
+        _indexes.popitem(last=False)
+    return index
+
+
+def line_offset(mm: mmap.mmap, index: tuple, line: int) -> int:
+    """Start offset of the 0-based `line`, found from the nearest checkpoint."""
+    lines, offsets, _ = index
+    i = bisect.bisect_right(lines, line) - 1
+    pos = offsets[i]
+    for _ in range(line - lines[i]):
+        pos = mm.find(b'\n', pos) + 1
+    return pos
+
+
+@toolwrapper(name="read", visible=True)
+def read(filepath: str, line_number: int = 1, num_lines: int = 200, byte_offset: Optional[int] = None, max_bytes: int = 16 * 1024):
+    """
+    Read a range of a text file, by lines or by bytes, without loading the whole file.
+
+    Args:
+        filepath (str): Absolute path of the file.
+        line_number (int, optional): The first line to read, starting from 1; negative values count from the end, -1 is the last line. Defaults to 1.
+        num_lines (int, optional): The maximum number of lines to read. Defaults to 200.
+        byte_offset (int, optional): Read from this byte offset instead of by lines; negative values count from the end.
+        max_bytes (int, optional): The maximum number of bytes to read. Defaults to 16384.
+
+    Returns:
+        str: the content read.
+    """
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            if byte_offset is not None:
+                start = max(0, size + byte_offset) if byte_offset < 0 else min(byte_offset, size)
+                return mm[start:start + max_bytes].decode('utf-8', errors='replace')
+
+            index = get_index(filepath, mm)
+            total = index[2]
+            line = total + line_number if line_number < 0 else line_number - 1
+            if line < 0 or line >= total:
+                raise ValueError(f'Line {line_number} is out of range, {filepath} has {total} lines.')
+
+            start = line_offset(mm, index, line)
+            end = start
+            for _ in range(num_lines):
+                nxt = mm.find(b'\n', end)
+                end = size if nxt == -1 else nxt + 1
+                if end - start >= max_bytes or end == size:
+                    break
+            return mm[start:min(end, start + max_bytes)].decode('utf-8', errors='replace')
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+AGENT_DIR = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.abspath(AGENT_DIR))
+
+if 'CODELINKER_CFG' not in os.environ:
+    cfg = os.path.join(tempfile.mkdtemp(), 'private.toml')
+    with open(cfg, 'w') as f:
+        f.write('[[api_keys.activeagent]]\napi_key = "sk-test"\nmodel = "activeagent"\n')
+    os.environ['CODELINKER_CFG'] = cfg
+
+from activitywatch import ActivityWatchClient, parse_time, event_end
+from agentmodule import ActionListener
+
+
+class StandIn(object):
+    """A local stand-in of the ActivityWatch REST API, serving the events of `buckets`."""
+
+    def __init__(self, buckets: dict):
+        self.buckets = buckets
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                stand_in.requests.append((self.client_address[1], url.path, query))
+                if url.path == "/api/0/buckets/":
+                    body = {k: {"id": k, "type": v["type"]} for k, v in stand_in.buckets.items()}
+                else:
+                    # like ActivityWatch: the events ending after `start`, newest first
+                    start = parse_time(query["start"][0])
+                    events = stand_in.buckets[unquote(url.path.split('/')[4])]["events"]
+                    body = [e for e in events if event_end(e) > start][::-1]
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+
+
+def at(seconds: float) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds = seconds)).isoformat()
+
+
+def make_buckets() -> dict:
+    return {
+        "aw-watcher-window_host": {"type": "currentwindow", "events": [
+            {"id": 1, "timestamp": at(-30), "duration": 10, "data": {"app": "code", "title": "a.py"}},
+            {"id": 2, "timestamp": at(-20), "duration": 20, "data": {"app": "chrome", "title": "docs"}},
+        ]},
+        "aw-watcher-afk_host": {"type": "afkstatus", "events": [
+            {"id": 5, "timestamp": at(-30), "duration": 30, "data": {"status": "not-afk"}},
+        ]},
+        "aw-watcher-web-chrome": {"type": "web.tab.current", "events": [
+            {"id": 9, "timestamp": at(-20), "duration": 20, "data": {"url": "https://docs", "title": "docs"}},
+        ]},
+        "aw-watcher-other": {"type": "app.editor.activity", "events": []},
+    }
+
+
+def test_incremental_pull():
+    buckets = make_buckets()
+    stand_in = StandIn(buckets)
+    cursor_path = os.path.join(tempfile.mkdtemp(), 'activitywatch.json')
+
+    async def main():
+        client = ActivityWatchClient(base_url = stand_in.url, cursor_path = cursor_path)
+        assert await client.list_buckets() == {
+            "aw-watcher-window_host": "window", "aw-watcher-afk_host": "afk", "aw-watcher-web-chrome": "web"}
+        first = await client.pull()
+        assert [e["id"] for e in first["window"]] == [1, 2]
+        mtime = os.stat(cursor_path).st_mtime_ns
+
+        # only the newest event is read again, and the unchanged cursors are not written
+        second = await client.pull()
+        assert [e["id"] for e in second["window"]] == [2]
+        assert os.stat(cursor_path).st_mtime_ns == mtime
+
+        buckets["aw-watcher-window_host"]["events"].append(
+            {"id": 3, "timestamp": at(1), "duration": 5, "data": {"app": "term", "title": "bash"}})
+        third = await client.pull()
+        assert [e["id"] for e in third["window"]] == [2, 3]
+        await client.aclose()
+
+        # a restarted client reads from the saved cursors
+        restarted = ActivityWatchClient(base_url = stand_in.url, cursor_path = cursor_path)
+        await restarted.list_buckets()
+        assert [e["id"] for e in (await restarted.pull())["window"]] == [3]
+        await restarted.aclose()
+        # the connections are reused across the polls
+        return len({port for port, _, _ in stand_in.requests}), len(stand_in.requests)
+
+    connections, requests = asyncio.run(main())
+    stand_in.close()
+    assert connections < requests
+
+
+def test_activity_is_not_idle():
+    stand_in = StandIn(make_buckets())
+
+    async def main():
+        client = ActivityWatchClient(base_url = stand_in.url, cursor_path = os.path.join(tempfile.mkdtemp(), 'cursor.json'))
+        await client.list_buckets()
+        listener = ActionListener()
+        listener.last_post_time = datetime.now(timezone.utc) - timedelta(seconds = 25)
+
+        for kind, events in (await client.pull()).items():
+            listener.push_activity(kind, events)
+        # switching windows and tabs without typing is activity
+        assert not listener.is_idle()
+        data = listener.send_data()
+        assert [app["app"] for app in data["apps"]] == ["chrome", "code"]
+        assert data["info"]["web"][0]["url"] == "https://docs"
+        assert data["status"] == "not-afk"
+
+        # heartbeats of the same window are not
+        for kind, events in (await client.pull()).items():
+            listener.push_activity(kind, events)
+        assert listener.is_idle()
+
+        # an afk change is
+        listener.push_activity("afk", [{"id": 6, "timestamp": at(0), "duration": 0, "data": {"status": "afk"}}])
+        assert not listener.is_idle()
+        await client.aclose()
+
+    asyncio.run(main())
+    stand_in.close()
@@ -0,0 +1,71 @@
+import os
+import sys
+import asyncio
+import tempfile
+
+AGENT_DIR = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.abspath(AGENT_DIR))
+
+if 'CODELINKER_CFG' not in os.environ:
+    cfg = os.path.join(tempfile.mkdtemp(), 'private.toml')
+    with open(cfg, 'w') as f:
+        f.write('[[api_keys.activeagent]]\napi_key = "sk-test"\nmodel = "activeagent"\n')
+    os.environ['CODELINKER_CFG'] = cfg
+
+from components import DemoAgent
+
+
+def make_agent(**kwargs):
+    agent = DemoAgent(**kwargs)
+    calls = []
+
+    async def make_proposal():
+        calls.append('started')
+        await asyncio.sleep(0.2)
+        calls.append('done')
+
+    agent.make_proposal = make_proposal
+    return agent, calls
+
+
+def test_cancel_stale_supersedes_proposal():
+    async def main():
+        agent, calls = make_agent(cancel_stale = True)
+        first = asyncio.create_task(agent.propose())
+        await asyncio.sleep(0.05)
+        # a newer observation cancels the in-flight proposal, which is made again with it
+        await agent.propose()
+        await asyncio.wait_for(first, timeout = 2)
+        return calls, agent._superseded
+
+    calls, superseded = asyncio.run(main())
+    assert calls == ['started', 'started', 'done']
+    assert not superseded
+
+
+def test_shutdown_cancels_propose():
+    async def main():
+        agent, calls = make_agent(cancel_stale = True)
+        task = asyncio.create_task(agent.propose())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(main())
+
+
+def test_observations_are_coalesced():
+    async def main():
+        agent, calls = make_agent()
+        first = asyncio.create_task(agent.propose())
+        await asyncio.sleep(0.05)
+        for _ in range(3):
+            await agent.propose()
+        await first
+        return calls
+
+    assert asyncio.run(main()) == ['started', 'done', 'started', 'done']
@@ -10,11 +10,14 @@ import jsonlines
 import logging
 from copy import deepcopy
 from gym.components.activeagent import SYSTEM, STEP_OBJ
+from gym.trace import read_trace
+from gym.cache import install_cache
 from eval.reward_model_template import format_reward_instruction
 from codelinker import CodeLinker, CodeLinkerConfig
 
 cfg_file = "private.toml"
 cl = CodeLinker(CodeLinkerConfig.from_toml(cfg_file))
+install_cache(cl)
 agent_data_path = "dataset/agent_data"
 
 save_file = os.path.join(agent_data_path, "agent_traindata.jsonl")
@@ -198,15 +201,15 @@ def record_step(messages):
     save_writer.write(messages)
     
 async def main():
-    files = glob.glob(os.path.join(agent_data_path,"scene*.jsonl"))
+    files = glob.glob(os.path.join(agent_data_path,"scene*.jsonl")) + glob.glob(os.path.join(agent_data_path,"scene*.trace"))
     tasks = []
     total_length = 0
     for f in files:
-        with jsonlines.open(f) as reader:
-            data = list(reader)
-            fevents = list(filter(lambda x: 'events' in x['tags'] or ("agent.proactive" in x['tags'] and x["source"]=="ProactiveAgent"),data))
-            total_length += len(fevents)
-            pbar.total = total_length
+        # compact traces only decode the selected channels
+        data = list(read_trace(f, channels=["events", "agent.proactive", "agent.response"]))
+        fevents = list(filter(lambda x: 'events' in x['tags'] or ("agent.proactive" in x['tags'] and x["source"]=="ProactiveAgent"),data))
+        total_length += len(fevents)
+        pbar.total = total_length
         for d in data:
             if 'agent.response' in d['tags']:
                 messages = json.loads(d['content'])
@@ -7,8 +7,10 @@ import json
 import fire
 import tqdm
 from codelinker import CodeLinker, CodeLinkerConfig
+from gym.cache import install_cache
 cfg_file = "private.toml"
 cl = CodeLinker(CodeLinkerConfig.from_toml(cfg_file))
+install_cache(cl)
 
 example_events = []
 save_path = "dataset/agent_data"
@@ -188,6 +190,7 @@ async def main(seedfile: str, savefile: str):
         }
         settings['user']['theme'] = settings['environment']['theme']
         config = {
+            "seed": idx,
             "eventSink": {
                 "out_file": out_file_path,
             },
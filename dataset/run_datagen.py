@@ -14,13 +14,16 @@ def run(cfg_file_path,out_file_path):
             )
     else:
         ps = subprocess.run(
-            ["python","-m","gym.main","--cfg_file",cfg_file_path,"--out_file",out_file_path.replace(".jsonl","_noagent.jsonl")],
+            ["python","-m","gym.main","--cfg_file",cfg_file_path,"--out_file","_noagent".join(os.path.splitext(out_file_path))],
             stderr=sys.stderr,stdout=sys.stdout,env=os.environ,
             )
     ps.check_returncode()
     return
 
 if __name__ == "__main__":
+    # batch generation does not need wall-clock pacing
+    os.environ.setdefault("VIRTUAL_CLOCK","True")
+    os.environ.setdefault("STAGNATION_DETECTION","True")
 
     save_path = "dataset/agent_data"
 
@@ -31,7 +34,7 @@ if __name__ == "__main__":
         for file in cfg_files:
 
             tasks.append(
-                pool.submit(run,file,file.replace(".yaml",".jsonl"))
+                pool.submit(run,file,file.replace(".yaml",".trace" if os.environ.get("TRACE_FORMAT","jsonl") == "compact" else ".jsonl"))
             )
 
         for task in as_completed(tasks):
@@ -9,9 +9,12 @@ import tenacity
 from tqdm.asyncio import tqdm_asyncio as asyctqdm
 from codelinker import CodeLinker,CodeLinkerConfig
 
+from gym.cache import install_cache
+
 cfg = CodeLinkerConfig.from_toml("private.toml")
 cfg.request.use_cache = False
 cl = CodeLinker(config=cfg)
+install_cache(cl)
 sem = asyncio.Semaphore(16)
 
 SYSTEM = """<Role> You are a helpful assistant that provides proactive suggestions to the user. </Role> 
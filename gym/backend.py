@@ -0,0 +1,171 @@
+"""Pluggable request backends for CodeLinker.
+
+CodeLinker resolves the chat completion function by `request_lib`, so a backend is simply an async function
+with the same signature as `codelinker.request.openai.chatcompletion_request`.
+"""
+from typing import Optional
+import json
+import random
+import asyncio
+from codelinker import CodeLinker
+
+from .utils import count_tokens, count_message_tokens
+from .streaming import register_stream_lib, stream_usage
+
+
+WORDS = ["terminal", "script", "editor", "browser", "document", "error", "config", "server", "report",
+         "database", "commit", "test", "log", "network", "backup", "policy", "ticket", "dashboard"]
+ENTITIES = ["Workstation PC", "Code Editor", "Terminal", "Web Browser", "Backup Drive", "Chat App"]
+VERBS = ["opens", "edits", "saves", "runs", "reviews", "closes", "searches", "checks", "scrolls through", "copies"]
+
+
+class FakeBackend:
+    """A deterministic scripted backend that returns schema-valid completions from seeded templates.
+
+    Structured requests (tool calls) are filled according to their JSON schema, plain chat requests are
+    answered according to the gym prompt they carry (proposal, execution, reward judgement, summary...).
+
+    Args:
+        seed (int): Seed of the template sampling.
+        latency (float): Seconds to wait before each completion is returned.
+        events_per_step (int): Number of events in each generated `Events`.
+        accept_rate (float): Probability that a proposal is accepted by the simulated reward model.
+        propose_rate (float): Probability that the simulated agent proposes a task.
+    """
+
+    def __init__(self, seed: int = 0, latency: float = 0.0, events_per_step: int = 5, accept_rate: float = 0.5, propose_rate: float = 0.5):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.events_per_step = events_per_step
+        self.accept_rate = accept_rate
+        self.propose_rate = propose_rate
+        self.calls = 0
+
+    def sentence(self, subject: str = "The user") -> str:
+        return f"{subject} {self.rng.choice(VERBS)} the {self.rng.choice(WORDS)} {self.rng.choice(WORDS)} #{self.rng.randint(0, 9999)}."
+
+    def fake_value(self, schema: dict, name: str = ""):
+        if "enum" in schema:
+            return self.rng.choice(schema["enum"])
+        if "anyOf" in schema or "oneOf" in schema:
+            options = [s for s in schema.get("anyOf", schema.get("oneOf")) if s.get("type") != "null"]
+            return self.fake_value(options[0] if options else {"type": "null"}, name)
+
+        match schema.get("type"):
+            case "object":
+                return {k: self.fake_value(v, k) for k, v in schema.get("properties", {}).items()}
+            case "array":
+                size = self.events_per_step if name == "events" else self.rng.randint(1, 3)
+                return [self.fake_value(schema.get("items", {"type": "string"}), name) for _ in range(size)]
+            case "integer":
+                return self.rng.randint(1, 120)
+            case "number":
+                return self.rng.random() * 100
+            case "boolean":
+                # never finish or reject on our own, scenes run for the configured steps
+                return False if name == "is_finished" else self.rng.random() < self.accept_rate
+            case "null":
+                return None
+            case _:
+                match name:
+                    case "time":
+                        return f"{self.rng.randint(1, 12):02d}-{self.rng.randint(1, 28):02d} {self.rng.randint(0, 23):02d}:{self.rng.randint(0, 59):02d}:00"
+                    case "name":
+                        return self.rng.choice(ENTITIES)
+                    case "event" | "act" | "new_action":
+                        return self.sentence()
+                    case _:
+                        return self.sentence("It")
+
+    def fake_content(self, messages: list[dict], model: Optional[str]) -> str:
+        system = messages[0]["content"] if len(messages) > 0 and isinstance(messages[0]["content"], str) else ""
+        last = messages[-1]["content"] if len(messages) > 0 and isinstance(messages[-1]["content"], str) else ""
+
+        if model == "activerm" or "Evaluate the task proposed" in system:
+            return json.dumps({
+                "thought": self.sentence("I think the task"),
+                "judgement": "accepted" if self.rng.random() < self.accept_rate else "rejected",
+            })
+        if "Decide what to do next by executing available actions" in last:
+            return json.dumps({"Thoughts": self.sentence("The agent"), "Action": None})
+        if "provides proactive suggestions" in system:
+            task = self.sentence("Help the user with") if self.rng.random() < self.propose_rate else None
+            return json.dumps({
+                "Purpose": self.sentence(),
+                "Thoughts": self.sentence("The agent"),
+                "Proactive Task": task,
+                "Response": None if task is None else f"Do you want me to: {task}",
+            })
+        return " ".join(self.sentence() for _ in range(3))
+
+    async def __call__(self, *, config=None, **kwargs) -> dict:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return self.complete(**kwargs)
+
+    async def stream(self, *, config=None, chunk_size: int = 32, **kwargs):
+        """Stream the tool call arguments in chunks, spreading the latency over them."""
+        completion = self.complete(**kwargs)
+        arguments = completion["choices"][0]["message"]["tool_calls"][0]["function"]["arguments"]
+        chunks = [arguments[i:i + chunk_size] for i in range(0, len(arguments), chunk_size)]
+        for chunk in chunks:
+            if self.latency > 0:
+                await asyncio.sleep(self.latency / len(chunks))
+            yield chunk
+        usage = stream_usage.get()
+        if usage is not None:
+            for k, v in completion["usage"].items():
+                usage[k] = usage.get(k, 0) + v
+
+    def complete(self, **kwargs) -> dict:
+        if kwargs.get("seed") is None:
+            return self.fake_completion(**kwargs)
+        # seeded requests are answered independently of the order of the requests
+        rng, self.rng = self.rng, random.Random(kwargs["seed"])
+        try:
+            return self.fake_completion(**kwargs)
+        finally:
+            self.rng = rng
+
+    def fake_completion(self, **kwargs) -> dict:
+        self.calls += 1
+        messages = kwargs.get("messages", [])
+        if "tools" in kwargs:
+            function = kwargs["tools"][0]["function"]
+            arguments = json.dumps(self.fake_value(function["parameters"]))
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": f"call_{self.calls}",
+                "type": "function",
+                "function": {"name": function["name"], "arguments": arguments},
+            }]}
+            completion = arguments
+        else:
+            completion = self.fake_content(messages, kwargs.get("model"))
+            message = {"role": "assistant", "content": completion, "tool_calls": None}
+
+        return {
+            "id": f"fake-{self.calls}",
+            "object": "chat.completion",
+            "model": kwargs.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+            "usage": {
+                "prompt_tokens": count_message_tokens(messages),
+                "completion_tokens": count_tokens(completion),
+            },
+        }
+
+
+def install_fake_backend(cl: CodeLinker, **kwargs) -> FakeBackend:
+    """Route all requests of `cl` to a `FakeBackend`."""
+    backend = FakeBackend(**kwargs)
+    cl.objGen.register_request_lib("fake", backend)
+    register_stream_lib("fake", backend.stream)
+    cl.config.request.default_request_lib = "fake"
+    return backend
+
+
+def wrap_request_lib(cl: CodeLinker, middleware, request_lib: Optional[str] = None):
+    """Wrap the request function of `request_lib` (the default one if None) with `middleware(request_func) -> request_func`."""
+    request_lib = request_lib if request_lib is not None else cl.config.request.default_request_lib
+    request_func = cl.objGen._get_chatcompletion_request_func(request_lib)
+    cl.objGen.register_request_lib(request_lib, middleware(request_func))
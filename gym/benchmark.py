@@ -0,0 +1,144 @@
+"""Benchmark the gym orchestration (EventSink, tag locks, gather and component callbacks) without LLM latency.
+
+All completions are served by the scripted `FakeBackend` and the simulation runs on the virtual clock,
+so the measured time is the overhead of the orchestration itself.
+
+    CODELINKER_BACKEND=fake python -m gym.benchmark --sizes 10,100,1000 --agent True
+"""
+import os
+# must be set before gym.config is imported
+os.environ.setdefault("CODELINKER_BACKEND", "fake")
+os.environ.setdefault("VIRTUAL_CLOCK", "True")
+
+import math
+import time
+import json
+import yaml
+import fire
+import logging
+import tracemalloc
+import functools
+from collections import defaultdict
+from codelinker import EventSink
+
+from .components import ProactiveAgent, UserAgent, EnvironmentStateManager
+from .config import logger, clinker
+from .channel import sinkChannels
+from .backend import install_fake_backend
+from .main import setup_scene, run_scene
+
+
+def timed(func, stats: dict, key: str):
+    """Accumulate the wall time spent in an async component method."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            stats[key]["calls"] += 1
+            stats[key]["time"] += time.perf_counter() - start
+    return wrapper
+
+
+async def run_once(cfg: dict, num_events: int, agent: bool = False, seed: int = 0, latency: float = 0.0,
+                   events_per_step: int = 5, trace_memory: bool = True) -> dict:
+    backend = install_fake_backend(clinker, seed=seed, latency=latency, events_per_step=events_per_step)
+    sink = EventSink(sinkChannels=sinkChannels, logger=logger, beacon_interval=0.01)
+
+    env = EnvironmentStateManager(**cfg["environment"], sink=sink)
+    # `run_scene` starts the first step itself, the following ones are triggered up to `action_times`
+    action_times = max(math.ceil(num_events / events_per_step) - 1, 0)
+    user = UserAgent(**{**cfg["user"], "action_times": action_times}, sink=sink)
+    user.stream_events = env.stream_events
+    components = [env, user]
+    if agent:
+        components.append(ProactiveAgent(sink=sink))
+
+    # methods are wrapped before setup, so the listeners are registered with the timed version
+    stats = defaultdict(lambda: {"calls": 0, "time": 0.0})
+    for comp in components:
+        for method in ["intro", "step", "adapt_environment", "judge", "exec"]:
+            if hasattr(comp, method):
+                setattr(comp, method, timed(getattr(comp, method), stats, f"{comp.name}.{method}"))
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+
+    sink.init()
+    await setup_scene(sink, env)
+    await run_scene(sink, user)
+    await sink.close()
+    sink.run_scheduled_thd.cancel()
+
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    events = sum(sinkChannels.events in e.tags for e in sink.all_events)
+    return {
+        "target_events": num_events,
+        "events": events,
+        "sink_events": len(sink.all_events),
+        "requests": backend.calls,
+        "seconds": elapsed,
+        "events_per_second": events / elapsed if elapsed > 0 else 0.0,
+        "peak_memory_mb": peak / 2**20,
+        "components": {k: {"calls": v["calls"], "seconds": v["time"]} for k, v in sorted(stats.items())},
+    }
+
+
+async def benchmark(cfg_file: str = os.path.join(os.path.dirname(__file__), "example.yaml"),
+                    sizes: str | tuple = (10, 100, 1000, 10000),
+                    agent: bool = False,
+                    seed: int = 0,
+                    latency: float = 0.0,
+                    events_per_step: int = 5,
+                    trace_memory: bool = True,
+                    out_file: str | None = None):
+    """Run scenes of increasing size on the fake backend and report the orchestration throughput.
+
+    Args:
+        cfg_file (str): Scene config, only `environment` and `user` are used.
+        sizes (str | tuple): Number of events of each scene, e.g. `10,100,1000`.
+        agent (bool): Also setup a `ProactiveAgent` on the sink.
+        seed (int): Seed of the fake backend.
+        latency (float): Simulated latency in seconds of each completion.
+        events_per_step (int): Number of events generated by each environment step.
+        trace_memory (bool): Record the peak memory with `tracemalloc`, which slows down the run.
+        out_file (str, optional): Save the results as JSONL.
+    """
+    if clinker.config.request.default_request_lib != "fake":
+        raise ValueError("The benchmark requires CODELINKER_BACKEND=fake.")
+    if isinstance(sizes, str):
+        sizes = [int(s) for s in sizes.split(",")]
+    elif isinstance(sizes, int):
+        sizes = [sizes]
+
+    with open(cfg_file, 'r') as f:
+        cfg = yaml.safe_load(f)
+
+    # component logs dominate the run time otherwise
+    logger.setLevel(logging.WARNING)
+
+    results = []
+    for num_events in sizes:
+        res = await run_once(cfg, num_events, agent=agent, seed=seed, latency=latency,
+                             events_per_step=events_per_step, trace_memory=trace_memory)
+        results.append(res)
+        print(f"{res['events']:>6}/{res['target_events']} events | {res['seconds']:8.2f}s | {res['events_per_second']:8.1f} events/s | "
+              f"peak {res['peak_memory_mb']:7.1f} MB | {res['requests']} requests")
+        for name, s in res["components"].items():
+            print(f"    {name:<28} {s['calls']:>6} calls {s['seconds']:8.2f}s")
+
+    if out_file is not None:
+        with open(out_file, 'w') as f:
+            for res in results:
+                f.write(json.dumps(res) + '\n')
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark)
@@ -0,0 +1,186 @@
+"""Content-addressed completion store shared by the gym, the dataset scripts and the evaluation.
+
+Completions are stored in SQLite, keyed by the sha256 fingerprint of the request (see `gym.seeding.request_fingerprint`).
+The cache is a request lib middleware, configured with environment variables:
+
+- `COMPLETION_CACHE_MODE`: `passthrough` (default, no cache), `record` (serve hits, request and store misses) or
+  `replay` (serve hits, raise `CacheMiss` on misses, never calls the LLM).
+- `COMPLETION_CACHE`: Path of the SQLite file, defaults to `.cache/completions.sqlite`.
+- `COMPLETION_CACHE_MAX_MB`: Size cap of the stored completions, the least recently used ones are evicted. Defaults to 1024.
+
+Usage:
+    python -m gym.cache .cache/completions.sqlite
+"""
+from typing import Optional
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import weakref
+import fire
+from codelinker import CodeLinker
+
+from .backend import wrap_request_lib
+from .streaming import STREAM_LIBS
+from .seeding import request_fingerprint
+
+logger = logging.getLogger()
+
+MODES = ["passthrough", "record", "replay"]
+
+
+class CacheMiss(Exception):
+    """Raised in replay mode when a request is not in the store."""
+
+
+class CompletionCache:
+    """SQLite completion store with LRU eviction.
+
+    Args:
+        path (str): Path of the SQLite file, shared by processes.
+        mode (str): One of `record` or `replay`, see the module docstring.
+        max_bytes (int): Size cap of the stored responses.
+    """
+
+    def __init__(self, path: str, mode: str = "record", max_bytes: int = 1024 * 2**20):
+        if mode not in ["record", "replay"]:
+            raise ValueError(f"Cache mode should be 'record' or 'replay', but got {mode}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS completions (
+            key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, accessed REAL, hits INTEGER DEFAULT 0)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+        # approximate size of the store, other processes may write to it too
+        self.total = self.size()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bypassed": 0}
+        # the key last served to each task, a task asking again is retrying a completion it could not use
+        self.served = weakref.WeakKeyDictionary()
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self.db.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE completions SET accessed = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, model: Optional[str], response: dict):
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        self.db.execute("INSERT OR REPLACE INTO completions (key, model, response, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, model, data, len(data), now, now))
+        self.counters["stores"] += 1
+        self.total += len(data)
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def size(self) -> int:
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def evict(self):
+        self.total = self.size()
+        excess = self.total - self.max_bytes
+        if excess <= 0:
+            return
+        freed = 0
+        keys = []
+        for key, size in self.db.execute("SELECT key, size FROM completions ORDER BY accessed"):
+            keys.append(key)
+            freed += size
+            if freed >= excess:
+                break
+        self.db.executemany("DELETE FROM completions WHERE key = ?", [(k,) for k in keys])
+        self.counters["evictions"] += len(keys)
+        self.total -= freed
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """Serve a request from the store, `None` if it has to be requested."""
+        task = asyncio.current_task()
+        retrying = task is not None and self.served.get(task) == key
+        res = None if retrying else self.get(key)
+        if res is not None:
+            self.counters["hits"] += 1
+            if task is not None:
+                self.served[task] = key
+            return res
+        if retrying:
+            self.counters["bypassed"] += 1
+        else:
+            self.counters["misses"] += 1
+        if self.mode == "replay":
+            raise CacheMiss(f"Completion {key} is not in {self.path}.")
+        return None
+
+    def middleware(self, request_func):
+        async def cached_request(*, config, **kwargs):
+            key = request_fingerprint(kwargs, config)
+            res = self.lookup(key)
+            if res is not None:
+                return res
+            res = await request_func(config=config, **kwargs)
+            self.put(key, config.get_model_name(kwargs.get("model")), res)
+            return res
+        return cached_request
+
+    def stream_middleware(self, stream_func):
+        async def cached_stream(*, config, **kwargs):
+            key = request_fingerprint({**kwargs, "stream": True}, config)
+            res = self.lookup(key)
+            if res is not None:
+                yield res["arguments"]
+                return
+            chunks = []
+            async for chunk in stream_func(config=config, **kwargs):
+                chunks.append(chunk)
+                yield chunk
+            self.put(key, config.get_model_name(kwargs.get("model")), {"arguments": "".join(chunks)})
+        return cached_stream
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": self.counters["hits"] / lookups if lookups > 0 else 0.0,
+            "entries": self.db.execute("SELECT COUNT(*) FROM completions").fetchone()[0],
+            "size_mb": self.size() / 2**20,
+        }
+
+
+def install_cache(cl: CodeLinker, request_lib: Optional[str] = None) -> Optional[CompletionCache]:
+    """Cache the requests of `request_lib` (the default one if None) as configured by the environment variables."""
+    mode = os.environ.get("COMPLETION_CACHE_MODE", "passthrough")
+    if mode not in MODES:
+        raise ValueError(f"COMPLETION_CACHE_MODE should be one of {MODES}, but got {mode}")
+    if mode == "passthrough":
+        return None
+
+    cache = CompletionCache(
+        path=os.environ.get("COMPLETION_CACHE", os.path.join(".cache", "completions.sqlite")),
+        mode=mode,
+        max_bytes=int(float(os.environ.get("COMPLETION_CACHE_MAX_MB", 1024)) * 2**20),
+    )
+    request_lib = request_lib if request_lib is not None else cl.config.request.default_request_lib
+    wrap_request_lib(cl, cache.middleware, request_lib)
+    if request_lib in STREAM_LIBS:
+        STREAM_LIBS[request_lib] = cache.stream_middleware(STREAM_LIBS[request_lib])
+    logger.info(f"Completion cache in {mode} mode: {cache.path}")
+    return cache
+
+
+def show(path: str = os.path.join(".cache", "completions.sqlite")):
+    """Print the entries, size and hits of a completion store."""
+    db = sqlite3.connect(path)
+    entries, size, hits = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM completions").fetchone()
+    print(f"{path}: {entries} completions, {size / 2**20:.2f} MB, {hits} hits")
+    for model, n, h in db.execute("SELECT model, COUNT(*), SUM(hits) FROM completions GROUP BY model ORDER BY COUNT(*) DESC"):
+        print(f"  {model}: {n} completions, {h} hits")
+
+
+if __name__ == "__main__":
+    fire.Fire(show)
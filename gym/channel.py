@@ -66,6 +66,11 @@ class SinkChannels(Channels):
     def events(self):
         """Events channel is used to record all events that generated by simulater. Agent and user should listen to this channel to produce further ."""
         return ChannelTag("events")
+
+    @property
+    def terminate(self):
+        """Terminate channel records why a scene or an agent's execution is ended early."""
+        return ChannelTag("terminate")
     
                 
 
@@ -0,0 +1,75 @@
+import os
+import json
+import logging
+from codelinker import EventSink
+from codelinker.models import SEvent
+
+from .trace import read_trace, truncate_trace
+
+logger = logging.getLogger()
+
+
+def checkpoint_path(out_file: str) -> str:
+    return os.path.splitext(out_file)[0] + ".ckpt.json"
+
+
+class Checkpointer:
+    """Periodically save the simulation state next to the trace file.
+
+    The sink's event log is not duplicated in the checkpoint: only the number of events is recorded,
+    the events themselves are rebuilt from the trace on resume. Events spilled by the sink retention are counted
+    but not reloaded.
+    """
+
+    def __init__(self, out_file: str, sink: EventSink, components: dict, every: int = 1):
+        self.out_file = out_file
+        self.path = checkpoint_path(out_file)
+        self.sink = sink
+        self.components = components
+        self.every = every
+
+    def save(self, step: int):
+        if step % self.every != 0:
+            return
+        retention = getattr(self.sink, "retention", None)
+        state = {
+            "step": step,
+            "sink": {
+                "time": self.sink.time,
+                "events": len(self.sink.all_events) + (retention.spilled if retention is not None else 0),
+                "retention": retention.state_dict() if retention is not None else None,
+            },
+            "components": {name: comp.state_dict() for name, comp in self.components.items()},
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        logger.debug(f"Checkpoint saved at step {step} with {state['sink']['events']} events.")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path) and os.path.exists(self.out_file)
+
+    def load(self) -> dict:
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def restore(self) -> dict:
+        """Rebuild the sink from the checkpoint and the trace, truncating the events recorded after the checkpoint."""
+        state = self.load()
+        num_events = state["sink"]["events"]
+        retention = state["sink"].get("retention")
+        # the spilled events are kept in the trace only
+        pinned, spilled = (retention["pinned"], retention["spilled"]) if retention is not None else (0, 0)
+
+        truncate_trace(self.out_file, num_events)
+        events = [SEvent(**e) for e in read_trace(self.out_file, stop=pinned)]
+        events += [SEvent(**e) for e in read_trace(self.out_file, start=pinned + spilled)]
+
+        self.sink.all_events = events
+        if getattr(self.sink, "retention", None) is not None and retention is not None:
+            self.sink.retention.load_state_dict(retention)
+        self.sink.update_time(state["sink"]["time"])
+        for name, comp in self.components.items():
+            comp.load_state_dict(state["components"].get(name, {}))
+        return state
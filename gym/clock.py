@@ -0,0 +1,32 @@
+import asyncio
+import datetime
+
+TIME_FORMAT = "%m-%d %H:%M:%S"
+EPOCH = datetime.datetime(1900, 1, 1)
+
+
+class VirtualClock:
+    """Simulated time kept as seconds since `EPOCH`, rendered to `TIME_FORMAT` only when emitted.
+
+    In virtual mode `sleep` does not wait for the wall clock, so simulations run as fast as the LLM backend allows.
+    """
+
+    def __init__(self, virtual: bool = False):
+        self.virtual = virtual
+        self.seconds: float = 0.0
+
+    def set(self, time: str):
+        self.seconds = (datetime.datetime.strptime(time, TIME_FORMAT) - EPOCH).total_seconds()
+
+    def advance(self, delta: float):
+        self.seconds += delta
+
+    def render(self) -> str:
+        return (EPOCH + datetime.timedelta(seconds=self.seconds)).strftime(TIME_FORMAT)
+
+    async def sleep(self, seconds: float):
+        """Wait for `seconds` of wall-clock time, or only yield to other tasks in virtual mode."""
+        if self.virtual:
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(seconds)
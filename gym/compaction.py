@@ -0,0 +1,53 @@
+from typing import Optional
+from codelinker.models import SEvent
+
+from .utils import count_tokens
+
+STATUS_UPDATE_PREFIX = "Entity Updated.\n"
+
+
+def _text(msg: dict) -> str:
+    o = msg["content"]
+    return o.content if isinstance(o, SEvent) else o
+
+
+def updated_entity(content: str) -> Optional[str]:
+    """Return the entity name of an `Entity Updated.` status message, or None for other messages."""
+    if not content.startswith(STATUS_UPDATE_PREFIX):
+        return None
+    first_line = content[len(STATUS_UPDATE_PREFIX):].split("\n", 1)[0]
+    if first_line.startswith("Name: "):
+        return first_line[len("Name: "):].strip()
+    return None
+
+
+def compact_status(messages: list[dict], tail: int = 3) -> tuple[list[dict], int]:
+    """Compact the `env.status` updates in gathered messages.
+
+    Only the latest update of each entity is kept, plus the last `tail` updates as recent changes.
+    Other messages are left untouched and the order is preserved.
+
+    Returns:
+        tuple[list[dict], int]: the compacted messages and the number of tokens saved.
+    """
+    names = [updated_entity(_text(msg)) for msg in messages]
+
+    latest: dict[str, int] = {}
+    updates = []
+    for idx, name in enumerate(names):
+        if name is not None:
+            latest[name] = idx
+            updates.append(idx)
+
+    keep = set(latest.values())
+    if tail > 0:
+        keep.update(updates[-tail:])
+
+    compacted = []
+    saved_tokens = 0
+    for idx, (msg, name) in enumerate(zip(messages, names)):
+        if name is None or idx in keep:
+            compacted.append(msg)
+        else:
+            saved_tokens += count_tokens(_text(msg))
+    return compacted, saved_tokens
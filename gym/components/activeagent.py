@@ -1,9 +1,12 @@
 from .base import BasicComponet, sinkChannels
+from ..stagnation import StagnationDetector
 import re
 import os
 import sys
 import json
 from copy import deepcopy
+from typing import Optional
+from codelinker import EventSink
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -48,8 +51,24 @@ Respond in the following JSON format:
 
 
 class ProactiveAgent(BasicComponet):
-    def __init__(self,):
-        super().__init__("ProactiveAgent")
+    def __init__(self, model: Optional[str] = None, completions_kwargs: Optional[dict] = None, stagnation: Optional[dict] = None, use_activerm: Optional[bool] = None, sink: Optional[EventSink] = None):
+        super().__init__("ProactiveAgent", sink=sink)
+        self.model = model
+        self.default_completions_kwargs = completions_kwargs if completions_kwargs is not None else {}
+        # leave the execution loop early when the actions stagnate
+        if stagnation is None and os.environ.get("STAGNATION_DETECTION", "False") == "True":
+            stagnation = {}
+        self.stagnation = stagnation
+        # judge and retry the proposals with the reward model before making them
+        self.use_activerm = use_activerm if use_activerm is not None else os.environ.get("USE_ACTIVERM", "False") == "True"
+        self.rm = None
+
+    def completions_kwargs(self, **kwargs) -> dict:
+        """Build a fresh completions kwargs dict with the agent's model and sampling settings."""
+        ret = {**self.default_completions_kwargs, **kwargs}
+        if self.model is not None:
+            ret["model"] = self.model
+        return ret
 
     @property
     def memory(self):
@@ -62,15 +81,18 @@ class ProactiveAgent(BasicComponet):
     async def exec(self):
         async with self.get_tag_lock(sinkChannels.agent.proactive):
             self.unlisten(self.step)
+            detector = StagnationDetector(name="agent execution", **self.stagnation) if self.stagnation is not None else None
             while True:
                 async with self.get_tag_lock(sinkChannels.activity):
-                    hist = self.gather([sinkChannels.activity, sinkChannels.events,
+                    hist = await self.gather_history([sinkChannels.activity, sinkChannels.events,
                                        sinkChannels.agent.proactive, sinkChannels.agent.ops])
                                         
                     res = await self.cl.exec(
                         prompt=EXEC,
                         return_type=str,
-                        messages=self.memory + hist
+                        request_name="execute_task",
+                        messages=self.memory + hist,
+                        completions_kwargs=self.completions_kwargs()
                     )
                     self.logger.warning(res)
                     ret = json.loads(res)
@@ -81,6 +103,13 @@ class ProactiveAgent(BasicComponet):
                         self.logger.info("Exit Execution.\n" +
                                          ret.get("Thoughts", "None"))
                         return
+                    if detector is not None:
+                        reason = detector.push(json.dumps(ret.get("Action")))
+                        if reason is not None:
+                            self.listen(sinkChannels.events)(self.step)
+                            self.logger.warning(f"Exit Execution: {reason}")
+                            self.add(sinkChannels.terminate, content=reason, silent=True)
+                            return
                     self.add(sinkChannels.activity, content=res)
 
                 await self.wait(sinkChannels.activity)
@@ -126,15 +155,18 @@ class ProactiveAgent(BasicComponet):
                 res = await self.cl.exec(
                     prompt=json.dumps(step_obj),
                     return_type=str,
-                    messages=self.memory + hist
+                    request_name="propose_task",
+                    messages=self.memory + hist,
+                    completions_kwargs=self.completions_kwargs()
                 )
                 self.logger.warning(res)
                 pred = self.extrat_pred(res)
                 
-                if os.environ.get("USE_ACTIVERM", "False") == "True":
-                    from .reward import RewardModel
-                    rm = RewardModel()
-                    res = await rm.judge(pred.get("Proactive Task", None))
+                if self.use_activerm:
+                    if self.rm is None:
+                        from .reward import RewardModel
+                        self.rm = RewardModel(sink=self.sink)
+                    res = await self.rm.judge(pred.get("Proactive Task", None))
                     
                     retry_times = 3
                     while not res.is_accepted and retry_times > 0:
@@ -146,12 +178,13 @@ class ProactiveAgent(BasicComponet):
                         res = await self.cl.exec(
                             prompt=json.dumps(step_obj),
                             return_type=str,
+                            request_name="propose_task",
                             messages=self.memory + hist,
-                            completions_kwargs={"temperature": 0.8}
+                            completions_kwargs=self.completions_kwargs(temperature=0.8)
                         )
                         self.logger.warning(res)
                         pred = self.extrat_pred(res)
-                        res = await rm.judge(pred.get("Proactive Task", None))
+                        res = await self.rm.judge(pred.get("Proactive Task", None))
                         retry_times -= 1
                     
                     if not res.is_accepted:
@@ -1,28 +1,181 @@
-from codelinker import EventProcessor
-from typing import Iterable, Literal
+from codelinker import EventProcessor, EventSink
+from typing import Iterable, Literal, Optional
+import os
 import json
+import random
+import asyncio
 from codelinker.models import SEvent, ChannelTag
-from ..config import clinker, eventSink, sinkChannels
+from ..config import clinker, eventSink, sinkChannels, simClock
+from ..compaction import compact_status
+from ..utils import count_tokens, count_message_tokens
+from ..seeding import derive_seed
+
+SUMMARY_SYSTEM = """<Task>
+You maintain a running summary of a simulation history. Merge the previous summary and the new history messages into an updated summary.
+</Task>
+
+<Rules>
+- Keep the latest status of entities, the key events and activities, the agent's proposals and the user's judgements.
+- Keep the timing information of important events.
+- Drop repeated or superseded information.
+- Write in plain text and be concise.
+</Rules>"""
+
+
+def match_tags(event: SEvent, tags: ChannelTag | Iterable[ChannelTag] | None) -> bool:
+    if tags is None:
+        return True
+    if isinstance(tags, ChannelTag):
+        return tags in event.tags
+    return any(tag in event.tags for tag in tags)
+
+
+def local_index(index: int, pinned: int, spilled: int) -> int:
+    """Map a message index of the full history to the messages kept in the sink."""
+    return index if index <= pinned else max(pinned, index - spilled)
+
+
 class BasicComponet(EventProcessor):
-    def __init__(self,name:str):
-        super().__init__(name=name,sink=eventSink)
+    def __init__(self,name:str,history_budget:Optional[int]=None,sink:Optional[EventSink]=None):
+        # components share the global sink unless they are run on a separate one, e.g. when replaying traces
+        super().__init__(name=name,sink=eventSink if sink is None else sink)
         self.listen(sinkChannels.setup)(self.setup)
         self.cl = clinker
-    def gather(self, tags: ChannelTag | Iterable[ChannelTag] | None = None,return_dumper:Literal['identity','json']='json') -> str | Iterable[dict]:
-        messages = super().gather(tags=tags,return_dumper='identity')
+        self.clock = simClock
+        self.status_tokens_saved = 0
+        # fold older history into a summary once the gathered history exceeds the budget (in tokens)
+        if history_budget is None:
+            history_budget = int(os.environ.get("HISTORY_TOKEN_BUDGET", 0)) or None
+        self.history_budget = history_budget
+        self.history_summaries: dict[tuple, dict] = {}
+        # all random choices of the component go through `rng`, see `seed`
+        self.rng = random.Random()
+
+    def seed(self, seed: int):
+        """Seed the component's random generator from the scene seed."""
+        self.rng.seed(derive_seed(seed, self.name))
+
+    def state_dict(self) -> dict:
+        """State saved into checkpoints."""
+        version, internal, gauss_next = self.rng.getstate()
+        return {
+            "history_summaries": {
+                "|".join(key): {"folded": state["folded"], "summary": state["summary"], "spilled": state["spilled"]}
+                for key, state in self.history_summaries.items()
+            },
+            "rng": [version, list(internal), gauss_next],
+        }
+
+    def load_state_dict(self, state: dict):
+        if state.get("rng") is not None:
+            version, internal, gauss_next = state["rng"]
+            self.rng.setstate((version, tuple(internal), gauss_next))
+        for key, s in state.get("history_summaries", {}).items():
+            self.history_summaries[tuple(key.split("|"))] = {"folded": s["folded"], "summary": s["summary"], "spilled": s.get("spilled", 0), "lock": asyncio.Lock()}
+
+    def dump_messages(self, messages: list[dict]) -> list[dict]:
+        for msg in messages:
+            o = msg['content']
+            if isinstance(o,SEvent):
+                msg['content'] = json.dumps({
+                    "Time": o.time,
+                    "Source": o.source,
+                    "Tags": o.tags,
+                    "Event": o.content
+                })
+        return messages
+
+    @property
+    def retention(self):
+        return getattr(self.sink, "retention", None)
+
+    def on_spill(self, dropped: list[SEvent], pinned: int):
+        """Called when the sink retention drops `dropped` events after the `pinned` head."""
+        # summaries count folded messages over the full history, keep the number of spilled messages to map it to the sink
+        for key, state in self.history_summaries.items():
+            state["spilled"] += sum(1 for e in dropped if match_tags(e, key))
+
+    def spill_offset(self, key: tuple, state: dict) -> tuple[int, int]:
+        """Number of pinned and spilled messages of a history summary."""
+        if self.retention is None:
+            return 0, 0
+        pinned = sum(1 for e in self.sink.all_events[:self.retention.pinned] if match_tags(e, key))
+        return pinned, state["spilled"]
+
+    def gather(self, tags: ChannelTag | Iterable[ChannelTag] | None = None,return_dumper:Literal['identity','json']='json', status_tail: Optional[int] = None, full_history: bool = False) -> str | Iterable[dict]:
+        """Gather messages from the sink. If `status_tail` is given, superseded entity updates in `env.status` are compacted, keeping the latest state of each entity and the last `status_tail` updates.
+        If `full_history` is True, the events spilled by the sink retention are reloaded from the trace."""
+        if full_history and self.retention is not None and self.retention.spilled > 0:
+            messages = [{'role': 'assistant', 'content': e.content} if e.source == self.name else {'role': 'user', 'content': e}
+                        for e in self.retention.full_events() if match_tags(e, tags)]
+        else:
+            messages = super().gather(tags=tags,return_dumper='identity')
+        return self.render(messages, return_dumper=return_dumper, status_tail=status_tail)
+
+    def render(self, messages: list[dict], return_dumper:Literal['identity','json']='json', status_tail: Optional[int] = None) -> list[dict]:
+        messages = [dict(msg) for msg in messages]
+        if status_tail is not None:
+            messages, self.status_tokens_saved = compact_status(messages, tail=status_tail)
+            if self.status_tokens_saved > 0:
+                self.logger.debug(f"Status compaction saved {self.status_tokens_saved} prompt tokens.")
         match return_dumper:
             case 'identity':
                 return messages
             case 'json':
-                for msg in messages:
-                    o = msg['content']
-                    if isinstance(o,SEvent):
-                        msg['content'] = json.dumps({
-                            "Time": o.time,
-                            "Source": o.source,
-                            "Tags": o.tags,
-                            "Event": o.content
-                        })
-                return messages
+                return self.dump_messages(messages)
             case _:
-                raise ValueError(f"return_dumper should be 'identity' or 'json', but got {return_dumper}")
\ No newline at end of file
+                raise ValueError(f"return_dumper should be 'identity' or 'json', but got {return_dumper}")
+
+    async def gather_history(self, tags: ChannelTag | Iterable[ChannelTag], status_tail: Optional[int] = None) -> list[dict]:
+        """Gather json messages like `gather`, but keep them under `history_budget` tokens.
+
+        Older messages are folded into a cached summary, which is refreshed incrementally with the newly folded messages only.
+        """
+        if self.history_budget is None:
+            return self.render(super().gather(tags=tags,return_dumper='identity'), status_tail=status_tail)
+
+        key = (tags,) if isinstance(tags, ChannelTag) else tuple(sorted(tags))
+        if key not in self.history_summaries:
+            self.history_summaries[key] = {"folded": 0, "summary": None, "spilled": 0, "lock": asyncio.Lock()}
+        state = self.history_summaries[key]
+
+        async with state["lock"]:
+            messages = super().gather(tags=tags,return_dumper='identity')
+            offset = self.spill_offset(key, state)
+            recent = self.render(messages[local_index(state["folded"], *offset):], status_tail=status_tail)
+            summary_tokens = count_tokens(state["summary"]) if state["summary"] is not None else 0
+            if summary_tokens + count_message_tokens(recent) > self.history_budget:
+                await self.fold_history(state, messages, offset)
+
+        hist = self.render(messages[local_index(state["folded"], *offset):], status_tail=status_tail)
+        if state["summary"] is not None:
+            hist.insert(0, {"role": "user", "content": f"# Summary of Earlier History\n{state['summary']}"})
+        return hist
+
+    async def fold_history(self, state: dict, messages: list[dict], offset: tuple[int, int] = (0, 0)):
+        # keep the latest messages that fit in half of the budget, fold the rest
+        start = local_index(state["folded"], *offset)
+        keep_tokens = 0
+        folded = len(messages)
+        while folded > start:
+            msg = self.dump_messages([dict(messages[folded-1])])[0]
+            keep_tokens += count_tokens(msg["content"])
+            if keep_tokens > self.history_budget // 2:
+                break
+            folded -= 1
+        if folded <= start:
+            return
+
+        new_messages = self.dump_messages([dict(m) for m in messages[start:folded]])
+        prompt = "Now update the summary with the history messages above."
+        if state["summary"] is not None:
+            prompt = f"# Previous Summary\n{state['summary']}\n" + prompt
+        state["summary"] = await self.cl.exec(
+            prompt=prompt,
+            return_type=str,
+            request_name="summarize_history",
+            messages=[{"role": "system", "content": SUMMARY_SYSTEM}] + new_messages,
+        )
+        self.logger.debug(f"Folded {folded - start} messages into history summary.")
+        pinned, spilled = offset
+        state["folded"] = folded if folded <= pinned else folded + spilled
@@ -1,7 +1,10 @@
 import json
-from gym.models.env import EnvironmentSetting, EntityStatus, EntityUpdate, IntroEnv, Events
+import asyncio
+from gym.models.env import EnvironmentSetting, EntityStatus, EntityUpdate, IntroEnv, Events, NewEvent
 from .base import BasicComponet, sinkChannels
-import random
+from ..streaming import stream_items
+from typing import Optional
+from codelinker import EventSink
 
 SYSTEM = """<Role>
 You are tasked with simulating an environment within a system. The content labeled `Source: environment` reflects your past actions and decisions.
@@ -23,8 +26,8 @@ Generate and refine detailed environment settings. Based on the latest activitie
 
 class EnvironmentStateManager(BasicComponet):
 
-    def __init__(self, theme: str, description: str, events_example: list[str], agent_ops: str,entities:str, *args, **kwargs):
-        super().__init__("EnvManager")
+    def __init__(self, theme: str, description: str, events_example: list[str], agent_ops: str,entities:str, status_tail: Optional[int] = 3, history_budget: Optional[int] = None, stream_events: bool = False, sink: Optional[EventSink] = None, *args, **kwargs):
+        super().__init__("EnvManager", history_budget=history_budget, sink=sink)
 
         self.theme = theme
         self.description = description
@@ -32,12 +35,37 @@ class EnvironmentStateManager(BasicComponet):
         self.events_example = events_example
         self.agent_ops = agent_ops
         self.entities = entities
+        # keep the last `status_tail` entity updates, set to None to disable status compaction
+        self.status_tail = status_tail
+        # add each generated event to the sink as soon as it is streamed
+        self.stream_events = stream_events
+        self.step_lock = asyncio.Lock()
 
     @property
     def memory(self):
         return [{"role": "system", "content": SYSTEM}]
 
+    def state_dict(self) -> dict:
+        state = super().state_dict()
+        state["setting"] = self.setting.model_dump() if self.setting is not None else None
+        state["clock"] = self.clock.seconds
+        return state
+
+    def load_state_dict(self, state: dict):
+        super().load_state_dict(state)
+        if state.get("setting") is not None:
+            self.setting = EnvironmentSetting(**state["setting"])
+            self.clock.seconds = state["clock"]
+
     async def setup(self):
+        # the setting is already restored when resuming from a checkpoint
+        if self.setting is None:
+            await self.init_setting()
+
+        self.listen(sinkChannels.env.intro)(self.intro)
+        self.listen(sinkChannels.activity)(self.step)
+
+    async def init_setting(self):
         self.logger.info("Initializing Environment Objects...")
         self.setting = await self.cl.exec(
             prompt=json.dumps({
@@ -53,13 +81,10 @@ class EnvironmentStateManager(BasicComponet):
         )
         self.logger.debug(f"Initialized Environment Setting.\n{self.setting}")
         self.add(sinkChannels.agent.ops, content=f"# Assistant Available Operations\n{self.setting.agent_ops}")
+        self.clock.set(self.setting.time)
         self.update_time(self.setting.time)
         
         self.add(tags=sinkChannels.env.status, content=f"! Initial Environment Settings !\n{self.setting}")
-        
-        self.listen(sinkChannels.env.intro)(self.intro)
-        self.listen(sinkChannels.activity)(self.step)
-        
 
     def update_entity(self, entity: EntityStatus):
         exist = False
@@ -111,47 +136,71 @@ class EnvironmentStateManager(BasicComponet):
             f"Update Entities: {[e.name for e in res.updated_entities]}")
 
     def update_delta_time(self, delta: int):
-        import datetime 
-        current_time = datetime.datetime.strptime(self.setting.time, "%m-%d %H:%M:%S")
-        delta = datetime.timedelta(seconds=delta)
-        new_time = current_time + delta
-        self.setting.time = new_time.strftime("%m-%d %H:%M:%S")
+        self.clock.advance(delta)
+
+    def emit_time(self):
+        """Render the simulated time for the events going to be emitted."""
+        self.setting.time = self.clock.render()
         self.update_time(self.setting.time)
     
+    def emit_event(self, eve: NewEvent):
+        self.update_delta_time(eve.deltatime)
+        self.emit_time()
+        for eu in eve.updated_entities:
+            self.add(
+                tags=sinkChannels.env.status, content=f"Entity Updated.\n{self.update_status(eu=eu)}")
+        self.add(tags=sinkChannels.events, content=eve.event)
+
     async def step(self):
         """Updating environemnt """
-        # update time
+        # steps are serialized by the step lock, since the activity lock is released while streaming
+        async with self.step_lock:
+            if self.stream_events:
+                return await self.stream_step()
+
+            async with self.get_tag_lock(sinkChannels.activity):
+                prompt, hist = await self.prepare_step()
+                res = await self.cl.exec(
+                    prompt=prompt,
+                    return_type=Events,
+                    request_name="refine_events",
+                    messages=self.memory + hist
+                )
+
+                async with self.get_tag_lock(sinkChannels.events):
+                    for eve in res.events:
+                        self.emit_event(eve)
+
+    async def stream_step(self):
         async with self.get_tag_lock(sinkChannels.activity):
-            hist = self.gather([sinkChannels.env.status,sinkChannels.events,sinkChannels.agent.ops,sinkChannels.agent.actions])
+            prompt, hist = await self.prepare_step()
 
-            last_activity = json.loads(self.gather(sinkChannels.activity)[-1]["content"])
-                
-            source = last_activity["Source"]
-            samples = random.sample(self.events_example,k=5)
+        # the user and the agent can react to the first events while the rest are generated
+        async for eve in stream_items(self.cl, return_type=Events, key="events", item_type=NewEvent,
+                                      prompt=prompt, messages=self.memory + hist, request_name="refine_events"):
+            async with self.get_tag_lock(sinkChannels.events):
+                self.emit_event(eve)
 
-            if source == "User":
-                replaces = [("Agent","User"),("agent","user")]
-            elif source == "ProactiveAgent":
-                replaces = [("User","Agent"),("user","agent")]
+    async def prepare_step(self) -> tuple[str, list[dict]]:
+        """Build the prompt and history to generate the events of the latest activity."""
+        hist = await self.gather_history([sinkChannels.env.status,sinkChannels.events,sinkChannels.agent.ops,sinkChannels.agent.actions],status_tail=self.status_tail)
+
+        last_activity = json.loads(self.gather(sinkChannels.activity)[-1]["content"])
             
-            for i in range(len(samples)):
-                for r in replaces:
-                    samples[i] = samples[i].replace(r[0],r[1])
-                    
-            res = await self.cl.exec(
-                prompt=f"""<Samples>\n{json.dumps(samples)}\n</Samples>\n<Latest Activity>\n<From {source}>{json.dumps(last_activity['Event'])}</Last Activity>\nBased on the latest activity, generate multiple events describing environmental changes. Make sure the events' subject is {source}. Include both meaningful and occasionally meaningless actions, similar to the provided samples. Maintain consistent granularity across all events, and generate as many events as possible.""",
-                return_type=Events,
-                request_name="refine_events",
-                messages=self.memory + hist
-            )
+        source = last_activity["Source"]
+        samples = self.rng.sample(self.events_example,k=5)
 
-            async with self.get_tag_lock(sinkChannels.events):
-                for eve in res.events:
-                    self.update_delta_time(eve.deltatime)
-                    for eu in eve.updated_entities:
-                        self.add(
-                            tags=sinkChannels.env.status, content=f"Entity Updated.\n{self.update_status(eu=eu)}")
-                    self.add(tags=sinkChannels.events, content=eve.event)
+        if source == "User":
+            replaces = [("Agent","User"),("agent","user")]
+        elif source == "ProactiveAgent":
+            replaces = [("User","Agent"),("user","agent")]
+        
+        for i in range(len(samples)):
+            for r in replaces:
+                samples[i] = samples[i].replace(r[0],r[1])
+
+        prompt = f"""<Samples>\n{json.dumps(samples)}\n</Samples>\n<Latest Activity>\n<From {source}>{json.dumps(last_activity['Event'])}</Last Activity>\nBased on the latest activity, generate multiple events describing environmental changes. Make sure the events' subject is {source}. Include both meaningful and occasionally meaningless actions, similar to the provided samples. Maintain consistent granularity across all events, and generate as many events as possible."""
+        return prompt, hist
 
     # async def get_agent_ops(self):
     #     async with self.get_tag_lock(sinkChannels.env.status):
@@ -1,34 +1,170 @@
 import os
-import openai
 import json
+import time
+import asyncio
+import contextvars
+from collections import deque
 import tenacity
 from typing import Optional
 from .base import BasicComponet, sinkChannels
+from ..config import clinker
+from ..profiler import current_component
 from eval.reward_model_template import format_reward_instruction
 
+from codelinker import EventSink
 from codelinker.models import SEvent
 from gym.models.user import Judge
 
-class RewardModel(BasicComponet):
-    def __init__(self, ):
-        super().__init__("reward_model")
 
-    async def judge(self, pred_task: Optional[str]) -> Judge:
-        events = self.gather(tags=[sinkChannels.events], return_dumper="identity")
-        
-        events = [{
-            "time": msg['content'].time,
-            "event": msg['content'].content,
-            } for msg in events if isinstance(msg['content'],SEvent)]
-        
-        async for attemp in tenacity.AsyncRetrying(wait=tenacity.wait_fixed(1)):
+class JudgeService:
+    """Process-wide service that judges proposals with the reward model.
+
+    Concurrent judge requests from all scenes are collected for `batch_wait` seconds (up to `max_batch` requests),
+    identical requests in a batch share one completion, and at most `max_concurrency` completions run at a time.
+    Failed completions are retried with exponential backoff, up to `max_attempts` times.
+    """
+
+    def __init__(self, max_batch: int = 16, batch_wait: float = 0.05, max_concurrency: int = 8,
+                 max_attempts: int = 5, backoff: float = 1.0, max_backoff: float = 30.0):
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.loop = None
+        self.queue: asyncio.Queue = None
+        self.worker_thd: asyncio.Task = None
+        self.sem: asyncio.Semaphore = None
+        self.in_flight = 0
+        self.tasks: set[asyncio.Task] = set()
+        self.counters = {"requests": 0, "batches": 0, "completions": 0, "deduplicated": 0, "retries": 0, "failures": 0}
+        self.queue_delays = deque(maxlen=10000)
+        self.latencies = deque(maxlen=10000)
+
+    def start(self):
+        # the queue and the worker are bound to the running loop
+        loop = asyncio.get_running_loop()
+        if self.loop is loop and self.worker_thd is not None and not self.worker_thd.done():
+            return
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.sem = asyncio.Semaphore(self.max_concurrency)
+        # run the worker in an empty context, so its completions are not attributed to the first caller,
+        # each completion is attributed to the component that requested it instead
+        self.worker_thd = contextvars.Context().run(loop.create_task, self.worker(), name="JudgeService: Worker")
+
+    async def judge(self, events: list[dict], pred_task: Optional[str]) -> Judge:
+        self.start()
+        messages = format_reward_instruction(obs=events, pred_task=pred_task)
+        future = self.loop.create_future()
+        self.counters["requests"] += 1
+        await self.queue.put((json.dumps(messages), messages, future, time.perf_counter(), current_component.get()))
+        return await future
+
+    async def worker(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            now = time.perf_counter()
+            groups: dict[str, list] = {}
+            for key, messages, future, enqueued_at, component in batch:
+                self.queue_delays.append(now - enqueued_at)
+                groups.setdefault(key, []).append((messages, future, component))
+            self.counters["batches"] += 1
+            self.counters["deduplicated"] += len(batch) - len(groups)
+            for items in groups.values():
+                # a shared completion is attributed to the first requester
+                messages, _, component = items[0]
+                task = asyncio.create_task(self.dispatch(messages, [future for _, future, _ in items], component))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def dispatch(self, messages: list[dict], futures: list[asyncio.Future], component: Optional[str] = None):
+        async with self.sem:
+            self.in_flight += 1
+            start = time.perf_counter()
+            token = current_component.set(component)
+            try:
+                res = await self.request(messages)
+            except Exception as e:
+                self.counters["failures"] += 1
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            finally:
+                current_component.reset(token)
+                self.in_flight -= 1
+                self.latencies.append(time.perf_counter() - start)
+            for future in futures:
+                if not future.done():
+                    future.set_result(res)
+
+    async def request(self, messages: list[dict]) -> Judge:
+        async for attemp in tenacity.AsyncRetrying(
+                stop=tenacity.stop_after_attempt(self.max_attempts),
+                wait=tenacity.wait_exponential(multiplier=self.backoff, max=self.max_backoff),
+                reraise=True):
             with attemp:
-                ret = await self.cl.exec(
-                    messages=format_reward_instruction(obs=events,pred_task=pred_task),
+                if attemp.retry_state.attempt_number > 1:
+                    self.counters["retries"] += 1
+                self.counters["completions"] += 1
+                ret = await clinker.exec(
+                    messages=messages,
                     model="activerm",
+                    request_name="reward_judge",
                     completions_kwargs={"temperature": 0.0 + 0.4 * (attemp.retry_state.attempt_number > 1),}
                 )
                 res = json.loads(ret)
                 res = Judge(thought=res["thought"], is_accepted=res["judgement"]=="accepted")
+        return res
+
+    def stats(self) -> dict:
+        def summary(values) -> dict:
+            if len(values) == 0:
+                return {"mean": 0.0, "p95": 0.0, "max": 0.0}
+            values = sorted(values)
+            return {"mean": sum(values) / len(values), "p95": values[min(len(values) - 1, int(len(values) * 0.95))], "max": values[-1]}
+
+        return {
+            **self.counters,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "in_flight": self.in_flight,
+            "queue_delay": summary(self.queue_delays),
+            "latency": summary(self.latencies),
+        }
+
+
+judgeService = JudgeService(
+    max_concurrency=int(os.environ.get("JUDGE_MAX_CONCURRENCY", 8)),
+    max_attempts=int(os.environ.get("JUDGE_MAX_ATTEMPTS", 5)),
+)
+
+
+class RewardModel(BasicComponet):
+    def __init__(self, sink: Optional[EventSink] = None):
+        super().__init__("reward_model", sink=sink)
+
+    async def judge(self, pred_task: Optional[str]) -> Judge:
+        # the reward model judges on the whole scene, including the events spilled by the sink retention
+        events = self.gather(tags=[sinkChannels.events], return_dumper="identity", full_history=True)
+
+        events = [{
+            "time": msg['content'].time,
+            "event": msg['content'].content,
+            } for msg in events if isinstance(msg['content'],SEvent)]
+
+        res = await judgeService.judge(events, pred_task)
         self.logger.debug(res.model_dump_json())
-        return res  
\ No newline at end of file
+        return res
@@ -1,9 +1,12 @@
 import asyncio
 import os
 import json
+from typing import Optional
 
 from gym.models.user import UserInfo, Activity, Judge
 from .base import BasicComponet, sinkChannels
+from ..stagnation import StagnationDetector
+from codelinker import EventSink
 from codelinker.models import SEvent
 
 SYSTEM = """<Role>
@@ -23,8 +26,8 @@ Generate human-like activities with distinct characteristics and identities. You
 
 
 class UserAgent(BasicComponet):
-    def __init__(self, goal: str, theme: str, adapt_times: int = 2, action_times: int = 7, *args, **kwargs):
-        super().__init__("User")
+    def __init__(self, goal: str, theme: str, adapt_times: int = 2, action_times: int = 7, status_tail: Optional[int] = 3, history_budget: Optional[int] = None, stagnation: Optional[dict] = None, speculative: bool = False, sink: Optional[EventSink] = None, *args, **kwargs):
+        super().__init__("User", history_budget=history_budget, sink=sink)
         self.goal = goal
         self.theme = theme
         self.info: UserInfo = None
@@ -33,6 +36,25 @@ class UserAgent(BasicComponet):
         self.action_times = action_times
         self.wait_agent = False
         self.step_lock = asyncio.Lock()
+        # set to the environment's `stream_events`, streamed events trigger a step once per event
+        self.stream_events = False
+        self.checkpointer = None
+        # keep the last `status_tail` entity updates, set to None to disable status compaction
+        self.status_tail = status_tail
+        # end the scene early when the activities or events stagnate
+        if stagnation is None and os.environ.get("STAGNATION_DETECTION", "False") == "True":
+            stagnation = {}
+        self.detectors = {
+            "activity": StagnationDetector(name="activity", **stagnation),
+            "events": StagnationDetector(name="events", **stagnation),
+        } if stagnation is not None else {}
+        self.terminated: Optional[str] = None
+        self.rm = None
+        # generate the next activity while the agent's proposal is made and judged, keep it unless the proposal is accepted
+        self.speculative = speculative
+        self.judgements = 0
+        self.last_accepted = False
+        self.speculation_stats = {"kept": 0, "discarded": 0}
 
     @property
     def memory(self):
@@ -41,9 +63,30 @@ class UserAgent(BasicComponet):
             {"role": "user", "content": f"# Goal\n{self.goal}\n# User Info\n{self.info}"}
         ]
 
+    def state_dict(self) -> dict:
+        state = super().state_dict()
+        state["info"] = self.info.model_dump() if self.info is not None else None
+        state["finish"] = self.finish
+        state["terminated"] = self.terminated
+        state["detectors"] = {name: d.state_dict() for name, d in self.detectors.items()}
+        state["steps"] = self.sink.subscriber2callcount.get(self.step, 0)
+        return state
+
+    def load_state_dict(self, state: dict):
+        super().load_state_dict(state)
+        if state.get("info") is not None:
+            self.info = UserInfo(**state["info"])
+        self.finish = state.get("finish", False)
+        self.terminated = state.get("terminated", None)
+        for name, d in self.detectors.items():
+            d.load_state_dict(state.get("detectors", {}).get(name, {}))
+        # restore the emit count so that `action_times` keeps counting from the checkpoint
+        self.sink.subscriber2callcount[self.step] = state.get("steps", 0)
+
     async def setup(self):
-        # create characteristics and identities
-        await self.update_info()
+        # create characteristics and identities, unless restored from a checkpoint
+        if self.info is None:
+            await self.update_info()
 
         # init listen
         self.listen(sinkChannels.env.response, max_emit_time=self.adapt_times)(
@@ -85,29 +128,93 @@ class UserAgent(BasicComponet):
         self.add(tags=sinkChannels.env.intro, content=question +
                  "\nPlease answer the question one by one.",)
 
+    def last_events(self) -> str:
+        """Contents of the events generated since the last activity."""
+        events = []
+        for e in self.sink.all_events[::-1]:
+            if sinkChannels.activity in e.tags:
+                break
+            if sinkChannels.events in e.tags:
+                events.append(e.content)
+        return "\n".join(events[::-1])
+
+    def terminate(self, reason: str):
+        self.terminated = reason
+        self.finish = True
+        self.logger.warning(f"Scene terminated: {reason}")
+        self.add(tags=sinkChannels.terminate, content=reason, silent=True)
+
+    async def generate_activity(self) -> Activity:
+        hist = await self.gather_history(tags=[sinkChannels.activity, sinkChannels.env.status,
+                           sinkChannels.events, sinkChannels.agent.proactive], status_tail=self.status_tail)
+
+        return await self.cl.exec(
+            prompt="Now describe what's your next action to achieve the goal based on the environmental observation.",
+            return_type=Activity,
+            request_name="generate_activities",
+            messages=self.memory + hist
+        )
+
+    def discard(self, speculation: asyncio.Task):
+        if speculation.done() and not speculation.cancelled():
+            # retrieve the exception, if any, to avoid the unretrieved exception warning
+            speculation.exception()
+        speculation.cancel()
+        self.speculation_stats["discarded"] += 1
+
     async def step(self):
+        if self.terminated is not None:
+            return
         # random wait to simulate user's action
-        await asyncio.sleep(1)
+        await self.clock.sleep(1)
         if self.step_lock.locked():
             self.logger.warning("User step is locked.")
+            if self.stream_events:
+                # streamed events trigger the step one by one, skipped triggers do not count as actions
+                self.sink.subscriber2callcount[self.step] -= 1
             return
 
         async with self.step_lock:
+            speculation = None
+            judgements = self.judgements
+            if self.speculative:
+                speculation = asyncio.create_task(self.generate_activity())
+
             await self.wait(sinkChannels.agent.proactive)
-            await asyncio.sleep(1)
+            await self.clock.sleep(1)
             if self.wait_agent:
                 await self.wait([sinkChannels.activity])
 
             async with self.get_tag_lock(sinkChannels.activity):
-                hist = self.gather(tags=[sinkChannels.activity, sinkChannels.env.status,
-                                   sinkChannels.events, sinkChannels.agent.proactive])
-
-                res = await self.cl.exec(
-                    prompt="Now describe what's your next action to achieve the goal based on the environmental observation.",
-                    return_type=Activity,
-                    request_name="generate_activities",
-                    messages=self.memory + hist
-                )
+                events = self.last_events()
+                if "events" in self.detectors and len(events) > 0:
+                    reason = self.detectors["events"].push(events)
+                    if reason is not None:
+                        self.terminate(reason)
+
+                # the previous step is completed here, save it before generating the next activity
+                if self.checkpointer is not None:
+                    self.checkpointer.save(step=self.sink.subscriber2callcount.get(self.step, 0))
+                if self.terminated is not None:
+                    if speculation is not None:
+                        self.discard(speculation)
+                    return
+
+                res = None
+                if speculation is not None:
+                    if self.judgements > judgements and self.last_accepted:
+                        # the accepted proposal changed the environment, the speculative activity is stale
+                        self.discard(speculation)
+                    else:
+                        res = await speculation
+                        self.speculation_stats["kept"] += 1
+                    self.logger.debug(f"Speculative activities: {self.speculation_stats}")
+                if res is None:
+                    res = await self.generate_activity()
+                if not res.is_finished and "activity" in self.detectors:
+                    reason = self.detectors["activity"].push(res.act)
+                    if reason is not None:
+                        return self.terminate(reason)
                 if not res.is_finished:
                     return self.add(tags=sinkChannels.activity, content=res.act)
 
@@ -117,8 +224,9 @@ class UserAgent(BasicComponet):
     async def judge(self) -> bool:
 
         if os.environ.get("USE_ACTIVERM", "False") == "True":
-            from .reward import RewardModel
-            rm = RewardModel()
+            if self.rm is None:
+                from .reward import RewardModel
+                self.rm = RewardModel(sink=self.sink)
             pred_task = None
             for e in list(self.gather(tags=[sinkChannels.agent.proactive], return_dumper="identity"))[::-1]:
                 if isinstance(e["content"], SEvent):
@@ -128,11 +236,11 @@ class UserAgent(BasicComponet):
                             pred_task = d["Proactive Task"]
                             break
             
-            res = await rm.judge(pred_task=pred_task)
+            res = await self.rm.judge(pred_task=pred_task)
             
         else:
-            hist = self.gather(tags=[sinkChannels.activity, sinkChannels.env.status,
-                            sinkChannels.events, sinkChannels.agent.proactive])
+            hist = await self.gather_history(tags=[sinkChannels.activity, sinkChannels.env.status,
+                            sinkChannels.events, sinkChannels.agent.proactive], status_tail=self.status_tail)
             res = await self.cl.exec(
                 prompt="Do you accept the agent's proposal?",
                 return_type=Judge,
@@ -140,6 +248,8 @@ class UserAgent(BasicComponet):
                 messages=self.memory + hist
             )
 
+        self.judgements += 1
+        self.last_accepted = res.is_accepted
         self.add(tags=sinkChannels.agent.proactive,
                  content=f"{res.thought}\nIs Accepted: {res.is_accepted}")
 
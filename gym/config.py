@@ -6,6 +6,9 @@ import colorlog
 
 
 from .channel import sinkChannels
+from .clock import VirtualClock
+from .backend import install_fake_backend
+from .cache import install_cache
 
 
 logger = logging.getLogger()
@@ -36,7 +39,22 @@ logger.addHandler(console_handler)
 
 CL_CFGFILE = os.getenv("CODELINKER_CFG",os.path.join(os.path.dirname(__file__),'..',"private.toml"))
 
-cl_config = codelinker.CodeLinkerConfig(**toml.load(open(CL_CFGFILE)))
+# the fake backend replays scripted completions and needs no api keys, e.g. for orchestration benchmarks
+CL_BACKEND = os.getenv("CODELINKER_BACKEND","openai")
+
+if CL_BACKEND == "fake" and not os.path.exists(CL_CFGFILE):
+    cl_config = codelinker.CodeLinkerConfig()
+else:
+    cl_config = codelinker.CodeLinkerConfig(**toml.load(open(CL_CFGFILE)))
 
 clinker = codelinker.CodeLinker(config=cl_config,logger=logger)      
-eventSink = codelinker.EventSink(sinkChannels=sinkChannels,logger=logger,)
\ No newline at end of file
+if CL_BACKEND == "fake":
+    fakeBackend = install_fake_backend(clinker,
+                                       seed=int(os.getenv("FAKE_SEED", 0)),
+                                       latency=float(os.getenv("FAKE_LATENCY", 0)))
+# record/replay completions with COMPLETION_CACHE_MODE, installed before the seed middleware so seeds are part of the keys
+completionCache = install_cache(clinker)
+
+# virtual clock mode removes wall-clock sleeps and polls the sink more frequently
+simClock = VirtualClock(virtual=os.environ.get("VIRTUAL_CLOCK", "False") == "True")
+eventSink = codelinker.EventSink(sinkChannels=sinkChannels,logger=logger,beacon_interval=0.05 if simClock.virtual else 0.5)
\ No newline at end of file
@@ -0,0 +1,93 @@
+import os
+import asyncio
+from codelinker.models import SEvent
+
+from .components.base import BasicComponet, sinkChannels
+from .replay import AgentReplay
+from .trace import open_trace, read_trace, truncate_trace
+
+
+def fanout_path(out_file: str, name: str) -> str:
+    stem, ext = os.path.splitext(out_file)
+    return stem + f".{name}" + ext
+
+
+class AgentFanOut(BasicComponet):
+    """Drive several shadow agents with the simulated timeline of the main sink.
+
+    Each shadow agent runs on its own sink, so it has its own proposal channel and is judged by the reward model.
+    The shadow proposals never reach the main sink, so the user's trajectory follows the primary agent only.
+    """
+
+    def __init__(self, variants: dict[str, dict], out_file: str):
+        super().__init__("FanOut")
+        self.shadows = {name: AgentReplay(agent_kwargs=agent_kwargs, judge="reward") for name, agent_kwargs in variants.items()}
+        self.out_files = {name: fanout_path(out_file, name) for name in variants}
+        self.written = {name: 0 for name in variants}
+        self.writers = {}
+        self.forwarded = 0
+        self.forward_lock = asyncio.Lock()
+
+    def state_dict(self) -> dict:
+        state = super().state_dict()
+        state["forwarded"] = self.forwarded
+        state["written"] = self.written
+        return state
+
+    def load_state_dict(self, state: dict):
+        super().load_state_dict(state)
+        self.forwarded = state.get("forwarded", 0)
+        for name, shadow in self.shadows.items():
+            written = state.get("written", {}).get(name, 0)
+            events = []
+            if os.path.exists(self.out_files[name]):
+                events = [SEvent(**e) for e in read_trace(self.out_files[name], stop=written)]
+            shadow.sink.all_events = events
+            self.written[name] = len(events)
+
+    def on_spill(self, dropped: list[SEvent], pinned: int):
+        super().on_spill(dropped, pinned)
+        if self.forwarded > pinned:
+            self.forwarded = max(pinned, self.forwarded - len(dropped))
+
+    async def setup(self):
+        for name, shadow in self.shadows.items():
+            if self.written[name] == 0:
+                self.writers[name] = open_trace(self.out_files[name], "w")
+            else:
+                # drop the events written after the checkpoint
+                truncate_trace(self.out_files[name], self.written[name])
+                self.writers[name] = open_trace(self.out_files[name], "a")
+            await shadow.start()
+        self.listen(sinkChannels.events)(self.forward)
+
+    async def forward(self):
+        """Forward the new events and agent operations of the main sink to all shadow agents."""
+        async with self.forward_lock:
+            new_events = self.sink.all_events[self.forwarded:]
+            self.forwarded += len(new_events)
+
+            step = {"ops": [], "events": [], "judgement": None}
+            for event in new_events:
+                if sinkChannels.agent.ops in event.tags:
+                    step["ops"].append(event.model_dump())
+                elif sinkChannels.events in event.tags:
+                    step["events"].append(event.model_dump())
+            if len(step["events"]) == 0:
+                return
+
+            await asyncio.gather(*[shadow.feed(step) for shadow in self.shadows.values()])
+            self.flush()
+
+    def flush(self):
+        for name, shadow in self.shadows.items():
+            for event in shadow.sink.all_events[self.written[name]:]:
+                self.writers[name].write(event.model_dump())
+            self.writers[name].flush()
+            self.written[name] = len(shadow.sink.all_events)
+
+    async def close(self):
+        for shadow in self.shadows.values():
+            await shadow.stop()
+        for writer in self.writers.values():
+            writer.close()
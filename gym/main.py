@@ -1,60 +1,130 @@
 from typing import Optional
 import yaml
 import fire
-import json
 import uuid
 import os
+from codelinker import EventSink
 
 from .components import ProactiveAgent,UserAgent,EnvironmentStateManager
-from .config import logger,eventSink
+from .config import logger,eventSink,clinker,completionCache
 from .channel import sinkChannels
+from .checkpoint import Checkpointer
+from .fanout import AgentFanOut
+from .profiler import Profiler
+from .retention import EventRetention
+from .trace import open_trace, trace_ext
+from .seeding import install_seed
+from .components.reward import judgeService
 
-async def data_loop(cfg_file: str,out_file: Optional[str] = None):
+async def setup_scene(sink: EventSink, env: EnvironmentStateManager):
+    """Setup all components on the sink and adapt the environment."""
+    # wait Setup
+    sink.add(tags=sinkChannels.setup, content="Setup Components...",)
+    await sink.wait(sinkChannels.setup)
+    sink.add(tags=sinkChannels.setup,
+                    content="Setup Completed!", silent=True)
+
+    logger.info("*** Components setup completed. ***")
+    # setup environment adapation
+    await env.intro()
+    await sink.wait(sinkChannels.env.all)
+    logger.info("*** Environment Adaptation Completed. ***")
+
+async def run_scene(sink: EventSink, user: UserAgent):
+    """Start activity and events generation, and wait until the scene is finished."""
+    await user.step()
+
+    await sink.wait([sinkChannels.activity, sinkChannels.events, sinkChannels.agent.proactive])
+
+async def data_loop(cfg_file: str,out_file: Optional[str] = None,resume: bool = False,seed: Optional[int] = None):
     with open(cfg_file, 'r') as f:
         cfg = yaml.safe_load(f)
 
     if out_file is None:
-        out_file = cfg['eventSink'].get("out_file", uuid.uuid4().hex + ".jsonl")
+        out_file = cfg['eventSink'].get("out_file", uuid.uuid4().hex + trace_ext())
+
+    env = EnvironmentStateManager(**cfg["environment"])
+    user = UserAgent(**cfg["user"])
+    user.stream_events = env.stream_events
+    components = {"env": env, "user": user}
+    if os.environ.get("SETUP_PROACTIVE_AGENT","False") == "True":
+        agent = ProactiveAgent(**cfg.get("agent", {}))
+        components["agent"] = agent
+    if cfg.get("fanout"):
+        # shadow agents that follow the same timeline as the primary agent
+        fanout = AgentFanOut(cfg["fanout"], out_file)
+        components["fanout"] = fanout
+
+    # the scene seed makes a run reproducible, `--seed` overrides the one in the config
+    seed = seed if seed is not None else cfg.get("seed")
+    if seed is not None:
+        install_seed(clinker, seed, components)
 
-    if os.path.exists(out_file):
-        os.remove(out_file)
+    checkpointer = Checkpointer(out_file, eventSink, components, every=cfg.get("checkpoint", {}).get("every", 1))
+    user.checkpointer = checkpointer
 
-    out = open(out_file,"x")
+    if resume and not checkpointer.exists():
+        logger.warning(f"No checkpoint found for {out_file}, start a new simulation.")
+        resume = False
 
+    profiler = None
+    if os.environ.get("GYM_PROFILE","False") == "True":
+        # instrument before the components setup, so the listeners are registered with the profiled callbacks
+        profiler = Profiler(out_file, resume=resume)
+        profiler.install(clinker, eventSink, components)
+
+    # `out` is opened below, after the trace is restored
     def decorator(func):
         def wrapped_add(*args,**kwargs):
             ret = func(*args,**kwargs)
             for item in ret:
-                out.write(json.dumps(item.model_dump()) +'\n')
+                out.write(item.model_dump())
             out.flush()
             return ret
         return wrapped_add
     eventSink.add = decorator(eventSink.add)
 
-    # setup event source
-    eventSink.init(**cfg["eventSink"])
+    retention = None
+    if cfg.get("retention"):
+        # keep the setup and the latest events in memory, older events are only kept in the trace.
+        # installed after the trace writer, so the events are written before they can be spilled
+        retention = EventRetention(out_file, **cfg["retention"])
+        retention.install(eventSink, components)
 
-    env = EnvironmentStateManager(**cfg["environment"])
-    user = UserAgent(**cfg["user"])
-    if os.environ.get("SETUP_PROACTIVE_AGENT","False") == "True":
-        agent = ProactiveAgent(**cfg["agent"])
+    if resume:
+        state = checkpointer.restore()
+        out = open_trace(out_file,"a")
+    else:
+        for f in [out_file, out_file + ".idx", checkpointer.path]:
+            if os.path.exists(f):
+                os.remove(f)
+        out = open_trace(out_file,"x")
+    if retention is not None:
+        retention.attach(out)
 
-    # wait Setup
-    eventSink.add(tags=sinkChannels.setup, content="Setup Components...",)
-    await eventSink.wait(sinkChannels.setup)
-    eventSink.add(tags=sinkChannels.setup,
-                    content="Setup Completed!", silent=True)
+    # setup event source
+    eventSink.init(**cfg["eventSink"])
 
-    logger.info("*** Components setup completed. ***")
-    # setup environment adapation
-    await env.intro()
-    await eventSink.wait(sinkChannels.env.all)
-    logger.info("*** Environment Adaptation Completed. ***")
+    if resume:
+        # restored components only register their listeners
+        for comp in components.values():
+            await comp.setup()
+        logger.info(f"*** Resumed from step {state['step']} with {state['sink']['events']} events. ***")
+    else:
+        await setup_scene(eventSink, env)
 
-    # start activity and events generation
-    await user.step()
+    if retention is not None and not retention.active:
+        retention.start()
 
-    await eventSink.wait([sinkChannels.activity, sinkChannels.events, sinkChannels.agent.proactive])
+    await run_scene(eventSink, user)
+    if "fanout" in components:
+        await fanout.close()
+    if profiler is not None:
+        profiler.close()
+    if judgeService.counters["requests"] > 0:
+        logger.info(f"Judge service: {judgeService.stats()}")
+    if completionCache is not None:
+        logger.info(f"Completion cache: {completionCache.stats()}")
     out.close()
 
 if __name__ == "__main__":
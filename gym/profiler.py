@@ -0,0 +1,249 @@
+"""Opt-in profiler of gym runs.
+
+Records per component and per `request_name` the LLM call latency and tokens, the tag lock wait and hold times,
+the delay between scheduling and running a callback, and the time spent in `sink.wait`.
+Records are written to a side-car `<out_file>.profile.jsonl`, summarize them with
+
+    python -m gym.profiler gym_data/test.profile.jsonl
+"""
+from typing import Optional
+from contextvars import ContextVar
+from collections import defaultdict
+import os
+import json
+import time
+import fire
+import functools
+
+from codelinker import CodeLinker, EventSink
+from codelinker.models import ChannelTag
+
+from .backend import wrap_request_lib
+from .streaming import STREAM_LIBS, stream_usage
+
+current_component: ContextVar[Optional[str]] = ContextVar("current_component", default=None)
+current_request: ContextVar[Optional[dict]] = ContextVar("current_request", default=None)
+
+CALLBACKS = ["intro", "step", "adapt_environment", "judge", "exec", "forward"]
+
+
+def profile_path(out_file: str) -> str:
+    return os.path.splitext(out_file)[0] + ".profile.jsonl"
+
+
+class ProfiledLock:
+    """Proxy of a tag lock that records how long it is waited for and held."""
+
+    def __init__(self, lock, tag: str, profiler: "Profiler"):
+        self.lock = lock
+        self.tag = tag
+        self.profiler = profiler
+        self.acquired_at = None
+
+    def locked(self) -> bool:
+        return self.lock.locked()
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        await self.lock.acquire()
+        self.acquired_at = time.perf_counter()
+        self.profiler.record("lock_wait", self.tag, self.acquired_at - start)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.lock.release()
+        self.profiler.record("lock_hold", self.tag, time.perf_counter() - self.acquired_at)
+
+
+class Profiler:
+    """Collect timing records of the components running on a sink.
+
+    Each record has a `kind` (`llm`, `callback`, `queue`, `lock_wait`, `lock_hold`, `wait`), the `component` it is
+    attributed to, a `name` (request name, callback name or channel tag) and the measured `seconds`.
+    """
+
+    def __init__(self, out_file: str, resume: bool = False):
+        self.path = profile_path(out_file)
+        self.file = open(self.path, "a" if resume else "w")
+        self.start = time.perf_counter()
+        self.sink: Optional[EventSink] = None
+        # the time when a sink callback is scheduled, popped when the callback starts
+        self.pending: dict = {}
+
+    def record(self, kind: str, name: str, seconds: float, component: Optional[str] = None, **kwargs):
+        rec = {
+            "kind": kind,
+            "component": component if component is not None else current_component.get(),
+            "name": name,
+            "seconds": seconds,
+            "t": time.perf_counter() - self.start,
+            "sim_time": self.sink.time if self.sink is not None else None,
+            **kwargs,
+        }
+        self.file.write(json.dumps(rec) + "\n")
+        self.file.flush()
+
+    def install(self, cl: CodeLinker, sink: EventSink, components: dict):
+        """Instrument the linker, the sink and the callbacks of the components. Must be called before the components setup."""
+        self.sink = sink
+        self.install_linker(cl)
+        self.install_sink(sink)
+        for comp in components.values():
+            self.install_component(comp, comp.name, sink)
+            # the shadow agents of a fan-out run on their own sinks, their records are attributed to `FanOut.<variant>/<component>`
+            for name, shadow in getattr(comp, "shadows", {}).items():
+                self.install_sink(shadow.sink)
+                for sub in [shadow.agent, shadow.rm]:
+                    if sub is not None:
+                        self.install_component(sub, f"{comp.name}.{name}/{sub.name}", shadow.sink)
+
+    def install_component(self, comp, component: str, sink: EventSink):
+        for method in CALLBACKS:
+            if hasattr(comp, method):
+                # listeners are registered with the instance attribute in `setup`, so they use the profiled version
+                setattr(comp, method, self.profile_callback(getattr(comp, method), component, sink))
+
+    def install_linker(self, cl: CodeLinker):
+        exec_func = cl.exec
+
+        @functools.wraps(exec_func)
+        async def profiled_exec(*args, request_name: str = "request", **kwargs):
+            stats = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            token = current_request.set(stats)
+            start = time.perf_counter()
+            try:
+                return await exec_func(*args, request_name=request_name, **kwargs)
+            finally:
+                current_request.reset(token)
+                self.record("llm", request_name, time.perf_counter() - start, **stats)
+        cl.exec = profiled_exec
+
+        def middleware(request_func):
+            @functools.wraps(request_func)
+            async def profiled_request(*args, **kwargs):
+                response = await request_func(*args, **kwargs)
+                stats = current_request.get()
+                if stats is not None:
+                    usage = response.get("usage") or {}
+                    stats["requests"] += 1
+                    stats["prompt_tokens"] += usage.get("prompt_tokens", 0) or 0
+                    stats["completion_tokens"] += usage.get("completion_tokens", 0) or 0
+                return response
+            return profiled_request
+        wrap_request_lib(cl, middleware)
+
+        # streamed requests (`gym.streaming.stream_items`) bypass `cl.exec` and the request lib
+        request_lib = cl.config.request.default_request_lib
+        if request_lib in STREAM_LIBS:
+            STREAM_LIBS[request_lib] = self.profile_stream(STREAM_LIBS[request_lib])
+
+    def profile_stream(self, stream_func):
+        @functools.wraps(stream_func)
+        async def profiled_stream(*, config, **kwargs):
+            usage = {}
+            token = stream_usage.set(usage)
+            start = time.perf_counter()
+            try:
+                async for chunk in stream_func(config=config, **kwargs):
+                    yield chunk
+            finally:
+                try:
+                    stream_usage.reset(token)
+                except ValueError:
+                    # the stream was closed from another context
+                    pass
+                self.record("llm", kwargs["tool_choice"]["function"]["name"], time.perf_counter() - start, requests=1,
+                            prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0))
+        return profiled_stream
+
+    def install_sink(self, sink: EventSink):
+        add_func, wait_func = sink.add, sink.wait
+
+        @functools.wraps(add_func)
+        def profiled_add(*args, **kwargs):
+            scheduled = set(sink.scheduled_funcs)
+            ret = add_func(*args, **kwargs)
+            now = time.perf_counter()
+            for func in sink.scheduled_funcs - scheduled:
+                self.pending[func] = now
+            return ret
+        sink.add = profiled_add
+
+        @functools.wraps(wait_func)
+        async def profiled_wait(tags):
+            start = time.perf_counter()
+            try:
+                return await wait_func(tags)
+            finally:
+                name = str(tags) if isinstance(tags, ChannelTag) else ",".join(sorted(str(tag) for tag in tags))
+                self.record("wait", name, time.perf_counter() - start)
+        sink.wait = profiled_wait
+
+        sink.get_tag_lock = lambda tag: ProfiledLock(sink.tag2lock[tag], str(tag), self)
+
+    def profile_callback(self, func, component: str, sink: Optional[EventSink] = None):
+        sink = sink if sink is not None else self.sink
+
+        @functools.wraps(func)
+        async def profiled_callback(*args, **kwargs):
+            token = current_component.set(component)
+            start = time.perf_counter()
+            scheduled_at = self.pending.pop(sink.func2wrapper.get(profiled_callback), None)
+            if scheduled_at is not None:
+                self.record("queue", func.__name__, start - scheduled_at)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.record("callback", func.__name__, time.perf_counter() - start)
+                current_component.reset(token)
+        return profiled_callback
+
+    def close(self):
+        self.file.close()
+        report(self.path)
+
+
+def summarize(records: list[dict]) -> dict:
+    """Aggregate records by kind, component and name."""
+    groups = defaultdict(list)
+    for rec in records:
+        groups[(rec["kind"], rec["component"] or "-", rec["name"])].append(rec)
+
+    summary = {}
+    for (kind, component, name), recs in sorted(groups.items()):
+        seconds = sorted(r["seconds"] for r in recs)
+        s = {
+            "count": len(seconds),
+            "total": sum(seconds),
+            "mean": sum(seconds) / len(seconds),
+            "p50": seconds[len(seconds) // 2],
+            "p95": seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))],
+            "max": seconds[-1],
+        }
+        if kind == "llm":
+            for k in ["requests", "prompt_tokens", "completion_tokens"]:
+                s[k] = sum(r.get(k, 0) for r in recs)
+        summary[f"{kind}/{component}/{name}"] = s
+    return summary
+
+
+def report(profile_file: str, out_file: Optional[str] = None):
+    """Print a summary of a profile side-car and save it as JSON (`<profile>.summary.json` by default)."""
+    with open(profile_file, "r") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    summary = summarize(records)
+
+    lines = [f"{'kind/component/name':<60} {'count':>6} {'total':>9} {'mean':>8} {'p95':>8} {'tokens(in/out)':>16}"]
+    for key, s in summary.items():
+        tokens = f"{s['prompt_tokens']}/{s['completion_tokens']}" if "prompt_tokens" in s else ""
+        lines.append(f"{key:<60} {s['count']:>6} {s['total']:>8.2f}s {s['mean']:>7.3f}s {s['p95']:>7.3f}s {tokens:>16}")
+    print("\n".join(lines))
+
+    if out_file is None:
+        out_file = os.path.splitext(profile_file)[0] + ".summary.json"
+    with open(out_file, "w") as f:
+        json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    fire.Fire(report)
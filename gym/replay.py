@@ -0,0 +1,179 @@
+"""Replay recorded gym traces to proactive agents, without re-simulating the environment and the user."""
+from typing import Literal, Optional
+import os
+import glob
+import json
+import yaml
+import fire
+import asyncio
+
+from codelinker import EventSink
+from codelinker.models import SEvent
+
+from .components import ProactiveAgent
+from .components.reward import RewardModel, judgeService
+from .config import logger, completionCache
+from .channel import sinkChannels
+from .trace import open_trace, read_trace
+
+
+def load_trace(trace_file: str) -> list[dict]:
+    """Load the records of a trace that are replayed, see `split_steps`."""
+    channels = [sinkChannels.activity, sinkChannels.agent.ops, sinkChannels.events, sinkChannels.agent.proactive]
+    return list(read_trace(trace_file, channels=channels))
+
+
+def split_steps(trace: list[dict]) -> list[dict]:
+    """Split a trace into the steps seen by the agent.
+
+    Each step holds the `events` produced for one activity, the `agent.ops` updates before them,
+    and the user's recorded judgement on the recorded agent's proposal, if any.
+    """
+    steps = []
+    step = {"ops": [], "events": [], "judgement": None}
+    for record in trace:
+        tags = record["tags"]
+        if sinkChannels.activity in tags and len(step["events"]) > 0:
+            steps.append(step)
+            step = {"ops": [], "events": [], "judgement": None}
+        if sinkChannels.agent.ops in tags:
+            step["ops"].append(record)
+        elif sinkChannels.events in tags:
+            step["events"].append(record)
+        elif sinkChannels.agent.proactive in tags and record["source"] == "User" and step["judgement"] is None:
+            step["judgement"] = record
+    if len(step["events"]) > 0:
+        steps.append(step)
+    return steps
+
+
+class AgentReplay:
+    """Feed the steps of a trace to one agent variant running on its own sink.
+
+    The agent does not judge its own proposals (`USE_ACTIVERM`), each proposal is judged once by the replay."""
+
+    def __init__(self, agent_kwargs: Optional[dict] = None, judge: Literal["reward", "recorded"] = "reward"):
+        self.judge = judge
+        self.sink = EventSink(sinkChannels=sinkChannels, logger=logger, beacon_interval=0.05)
+        agent_kwargs = {"use_activerm": False, **(agent_kwargs if agent_kwargs is not None else {})}
+        self.agent = ProactiveAgent(sink=self.sink, **agent_kwargs)
+        self.rm = RewardModel(sink=self.sink) if judge == "reward" else None
+
+    def last_proposal(self, since: int) -> Optional[SEvent]:
+        for event in self.sink.all_events[since:][::-1]:
+            if sinkChannels.agent.proactive in event.tags and event.source == self.agent.name:
+                return event
+        return None
+
+    async def start(self):
+        self.sink.init()
+        await self.agent.setup()
+
+    async def stop(self):
+        await self.sink.close()
+        self.sink.run_scheduled_thd.cancel()
+
+    async def feed(self, step: dict) -> Optional[SEvent]:
+        """Feed one step to the agent, judge its proposal and return the proposal if there is one."""
+        for record in step["ops"]:
+            self.sink.update_time(record["time"])
+            self.sink.add(tags=sinkChannels.agent.ops, content=record["content"], source=record["source"], silent=True)
+
+        start = len(self.sink.all_events)
+        for record in step["events"]:
+            self.sink.update_time(record["time"])
+            self.sink.add(tags=sinkChannels.events, content=record["content"], source=record["source"])
+        await self.sink.wait([sinkChannels.events, sinkChannels.agent.proactive])
+
+        proposal = self.last_proposal(since=start)
+        if proposal is None or json.loads(proposal.content).get("Proactive Task", None) is None:
+            return proposal
+
+        # judgements are added silently, so the agent will not execute the proposal without an environment
+        match self.judge:
+            case "reward":
+                res = await self.rm.judge(pred_task=json.loads(proposal.content)["Proactive Task"])
+                self.sink.add(tags=sinkChannels.agent.proactive, content=f"{res.thought}\nIs Accepted: {res.is_accepted}", source="User", silent=True)
+            case "recorded":
+                if step["judgement"] is not None:
+                    self.sink.add(tags=sinkChannels.agent.proactive, content=step["judgement"]["content"], source="User", silent=True)
+            case _:
+                raise ValueError(f"judge should be 'reward' or 'recorded', but got {self.judge}")
+        return proposal
+
+    async def run(self, trace: list[dict]) -> list[SEvent]:
+        await self.start()
+        for step in split_steps(trace):
+            await self.feed(step)
+        await self.stop()
+        return self.sink.all_events
+
+
+def summarize(events: list[SEvent], agent_name: str = "ProactiveAgent") -> dict:
+    proposals = judged = accepted = 0
+    for event in events:
+        if sinkChannels.agent.proactive not in event.tags:
+            continue
+        if event.source == agent_name:
+            if json.loads(event.content).get("Proactive Task", None) is not None:
+                proposals += 1
+        elif event.source == "User":
+            judged += 1
+            accepted += event.content.endswith("Is Accepted: True")
+    return {"proposals": proposals, "judged": judged, "accepted": accepted}
+
+
+async def replay(traces: str = "dataset/agent_data/scene_*.jsonl",
+                 variants: Optional[str] = None,
+                 judge: Literal["reward", "recorded"] = "reward",
+                 out_dir: str = "replay",
+                 max_concurrency: int = 8):
+    """Replay recorded scenes to agent variants concurrently.
+
+    Args:
+        traces (str): Glob pattern of the recorded traces.
+        variants (str, optional): YAML file mapping variant names to `ProactiveAgent` kwargs (`model`, `completions_kwargs`). Defaults to a single default agent.
+        judge (str): Judge proposals with the reward model (`reward`) or reuse the judgements in the traces (`recorded`).
+        out_dir (str): Replayed traces are saved as `out_dir/<variant>/<scene>`, in the format of the recorded trace.
+        max_concurrency (int): Maximum number of replays running at the same time.
+    """
+    if variants is None:
+        variants = {"default": {}}
+    else:
+        with open(variants, 'r') as f:
+            variants = yaml.safe_load(f)
+
+    trace_files = sorted(glob.glob(traces))
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(name: str, agent_kwargs: dict, trace_file: str):
+        async with sem:
+            events = await AgentReplay(agent_kwargs=agent_kwargs, judge=judge).run(load_trace(trace_file))
+        os.makedirs(os.path.join(out_dir, name), exist_ok=True)
+        with open_trace(os.path.join(out_dir, name, os.path.basename(trace_file)), 'w') as f:
+            for event in events:
+                f.write(event.model_dump())
+        return name, summarize(events)
+
+    tasks = [run_one(name, agent_kwargs, trace_file) for name, agent_kwargs in variants.items() for trace_file in trace_files]
+    stats = {name: {"proposals": 0, "judged": 0, "accepted": 0} for name in variants}
+    for res in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(res, Exception):
+            logger.error(f"Replay failed: {res}")
+            continue
+        name, s = res
+        for k, v in s.items():
+            stats[name][k] += v
+
+    if judgeService.counters["requests"] > 0:
+        logger.info(f"Judge service: {judgeService.stats()}")
+    if completionCache is not None:
+        logger.info(f"Completion cache: {completionCache.stats()}")
+    for name, s in stats.items():
+        rate = s["accepted"] / s["judged"] if s["judged"] > 0 else 0.0
+        logger.info(f"[{name}] proposals: {s['proposals']}, judged: {s['judged']}, accepted: {s['accepted']} ({rate:.2%})")
+    return stats
+
+
+if __name__ == "__main__":
+    fire.Fire(replay)
@@ -0,0 +1,136 @@
+"""Bounded event retention for long simulations.
+
+Every event added to the sink is already written to the trace, so the trace is used as the spill segment:
+events older than the retention window are dropped from `sink.all_events` and reloaded from the trace only when a
+component asks for the full history.
+"""
+from typing import Optional
+from collections import deque
+import functools
+import logging
+
+from codelinker import EventSink
+from codelinker.models import SEvent
+
+from .utils import count_tokens
+from .trace import read_trace
+
+logger = logging.getLogger()
+
+
+class EventRetention:
+    """Keep the pinned head (setup and environment adaptation) and the latest events of the sink in memory.
+
+    `sink.all_events` holds `trace[:pinned] + trace[pinned + spilled:]`.
+
+    Args:
+        trace_file (str): The trace that every sink event is written to.
+        window (int, optional): Maximum number of unpinned events kept in memory.
+        token_budget (int, optional): Maximum tokens of the unpinned events kept in memory.
+    """
+
+    def __init__(self, trace_file: str, window: Optional[int] = None, token_budget: Optional[int] = None):
+        self.trace_file = trace_file
+        self.window = window
+        self.token_budget = token_budget
+        self.pinned = 0
+        self.spilled = 0
+        self.active = False
+        self.sink: Optional[EventSink] = None
+        self.components = []
+        # the live trace writer, whose in-memory index is used to reload the spilled events
+        self.writer = None
+        # tokens of the unpinned events in memory
+        self.tokens = deque()
+        self.tail_tokens = 0
+
+    def state_dict(self) -> dict:
+        return {"pinned": self.pinned, "spilled": self.spilled, "active": self.active}
+
+    def load_state_dict(self, state: dict):
+        self.pinned = state.get("pinned", 0)
+        self.spilled = state.get("spilled", 0)
+        self.active = state.get("active", False)
+        self.recount()
+
+    @property
+    def num_events(self) -> int:
+        """Number of events added to the sink, including the spilled ones."""
+        return len(self.sink.all_events) + self.spilled
+
+    def install(self, sink: EventSink, components: dict):
+        """Trim the sink after each add. Components are notified with `on_spill` to shift their event indices."""
+        self.sink = sink
+        self.components = list(components.values())
+        sink.retention = self
+        add_func = sink.add
+
+        @functools.wraps(add_func)
+        def add(*args, **kwargs):
+            ret = add_func(*args, **kwargs)
+            if self.active:
+                for event in ret:
+                    self.push(event)
+                self.trim()
+            return ret
+        sink.add = add
+
+    def attach(self, writer):
+        """Reload the spilled events through `writer`, the writer of `trace_file`."""
+        self.writer = writer
+
+    def start(self):
+        """Pin the events added so far and start trimming."""
+        self.pinned = len(self.sink.all_events)
+        self.active = True
+        self.recount()
+
+    def recount(self):
+        if self.sink is None:
+            return
+        self.tokens = deque()
+        self.tail_tokens = 0
+        for event in self.sink.all_events[self.pinned:]:
+            self.push(event)
+
+    def push(self, event: SEvent):
+        tokens = count_tokens(event.content)
+        self.tokens.append(tokens)
+        self.tail_tokens += tokens
+
+    def trim(self):
+        drop = 0
+        while len(self.tokens) - drop > 1 and (
+                (self.window is not None and len(self.tokens) - drop > self.window) or
+                (self.token_budget is not None and self.tail_tokens > self.token_budget)):
+            self.tail_tokens -= self.tokens[drop]
+            drop += 1
+        if drop == 0:
+            return
+
+        for _ in range(drop):
+            self.tokens.popleft()
+        dropped = self.sink.all_events[self.pinned:self.pinned + drop]
+        del self.sink.all_events[self.pinned:self.pinned + drop]
+        self.spilled += drop
+        for comp in self.components:
+            comp.on_spill(dropped, self.pinned)
+
+    def load_spilled(self) -> list[SEvent]:
+        """Reload the spilled events from the trace.
+
+        A compact trace is read through the index kept by its live writer, the `.idx` file is only saved on close."""
+        start, stop = self.pinned, self.pinned + self.spilled
+        reader = getattr(self.writer, "reader", None)
+        if reader is not None:
+            self.writer.flush()
+            events = reader.read(start=start, stop=stop)
+        else:
+            events = read_trace(self.trace_file, start=start, stop=stop)
+        return [SEvent(**e) for e in events]
+
+    def full_events(self) -> list[SEvent]:
+        if self.spilled == 0:
+            return self.sink.all_events
+        events = self.sink.all_events
+        return events[:self.pinned] + self.load_spilled() + events[self.pinned:]
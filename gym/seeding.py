@@ -0,0 +1,64 @@
+"""Reproducible scenes.
+
+A scene `seed` (in the YAML config) seeds the random generator of every component and the `seed` of every LLM request.
+Request seeds are derived from the scene seed and the request fingerprint, so re-running an unchanged scene sends
+the same requests with the same seeds, independently of the order in which concurrent requests are made.
+"""
+from typing import Optional
+import json
+import hashlib
+import logging
+from codelinker import CodeLinker
+
+from .backend import wrap_request_lib
+from .streaming import STREAM_LIBS
+
+logger = logging.getLogger()
+
+# request kwargs that do not change the completion
+VOLATILE_KWARGS = ["request_timeout"]
+
+
+def derive_seed(seed: int, *keys) -> int:
+    """A 31-bit seed derived from `seed` and `keys`, stable across processes (unlike `hash`)."""
+    digest = hashlib.sha256(json.dumps([seed, *keys], ensure_ascii=False, default=str).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % (2**31)
+
+
+def request_fingerprint(kwargs: dict, config=None) -> str:
+    """sha256 of the canonical JSON of a chat completion request. The model alias is resolved with `config` if given."""
+    canonical = {k: v for k, v in kwargs.items() if k not in VOLATILE_KWARGS}
+    if config is not None:
+        canonical["model"] = config.get_model_name(kwargs.get("model"))
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def seed_middleware(seed: int):
+    """Request lib middleware that sets the `seed` of each request, see `wrap_request_lib`."""
+    def middleware(request_func):
+        async def seeded_request(*, config, **kwargs):
+            if "seed" not in kwargs:
+                kwargs["seed"] = derive_seed(seed, request_fingerprint(kwargs, config))
+            return await request_func(config=config, **kwargs)
+        return seeded_request
+    return middleware
+
+
+def seed_stream(seed: int, stream_func):
+    async def seeded_stream(*, config, **kwargs):
+        if "seed" not in kwargs:
+            kwargs["seed"] = derive_seed(seed, request_fingerprint(kwargs, config))
+        async for chunk in stream_func(config=config, **kwargs):
+            yield chunk
+    return seeded_stream
+
+
+def install_seed(cl: CodeLinker, seed: int, components: dict, request_lib: Optional[str] = None):
+    """Seed the components of a scene and the requests of `request_lib` (the default one if None)."""
+    request_lib = request_lib if request_lib is not None else cl.config.request.default_request_lib
+    for comp in components.values():
+        comp.seed(seed)
+    wrap_request_lib(cl, seed_middleware(seed), request_lib)
+    if request_lib in STREAM_LIBS:
+        STREAM_LIBS[request_lib] = seed_stream(seed, STREAM_LIBS[request_lib])
+    logger.info(f"Scene seeded with {seed}.")
@@ -0,0 +1,85 @@
+"""Online detection of repeated, cyclic or unproductive behavior in a simulation."""
+from typing import Optional
+import re
+import zlib
+
+
+def shingles(text: str, size: int = 3) -> set[int]:
+    """Hash the word `size`-grams of a text. Numbers and punctuation are ignored, so ids and timestamps do not count as progress."""
+    words = re.findall(r"[a-z]+", text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode())} if len(words) > 0 else set()
+    return {zlib.crc32(" ".join(words[i:i + size]).encode()) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if len(a) == 0 and len(b) == 0:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class StagnationDetector:
+    """Detect repeated or cyclic contents and no-progress streaks in a stream of texts.
+
+    Args:
+        name (str): Name of the stream, used in the reasons.
+        window (int): Number of recent texts to compare with.
+        similarity (float): Jaccard similarity of the shingles above which two texts are the same.
+        patience (int): Number of consecutive repeated or unproductive texts before stagnation is reported.
+        max_period (int): Longest cycle to detect, a period of 1 is a plain repetition.
+        min_novelty (float): Minimum fraction of shingles unseen in the window for a text to count as progress.
+        shingle_size (int): Number of words in a shingle.
+    """
+
+    def __init__(self, name: str = "activity", window: int = 8, similarity: float = 0.8, patience: int = 3,
+                 max_period: int = 3, min_novelty: float = 0.1, shingle_size: int = 3):
+        self.name = name
+        self.window = window
+        self.similarity = similarity
+        self.patience = patience
+        self.max_period = max_period
+        self.min_novelty = min_novelty
+        self.shingle_size = shingle_size
+        self.history: list[set[int]] = []
+        self.repeats = 0
+        self.stale = 0
+
+    def state_dict(self) -> dict:
+        return {"history": [sorted(h) for h in self.history], "repeats": self.repeats, "stale": self.stale}
+
+    def load_state_dict(self, state: dict):
+        self.history = [set(h) for h in state.get("history", [])]
+        self.repeats = state.get("repeats", 0)
+        self.stale = state.get("stale", 0)
+
+    def reset(self):
+        self.history = []
+        self.repeats = 0
+        self.stale = 0
+
+    def push(self, text: str) -> Optional[str]:
+        """Add a text to the stream, return the reason if the stream is stagnating."""
+        sh = shingles(text, self.shingle_size)
+
+        # the text repeats the one `period` steps before
+        period = None
+        for p in range(1, min(self.max_period, len(self.history)) + 1):
+            if jaccard(sh, self.history[-p]) >= self.similarity:
+                period = p
+                break
+        self.repeats = self.repeats + 1 if period is not None else 0
+
+        seen = set().union(*self.history)
+        novelty = len(sh - seen) / len(sh) if len(sh) > 0 else 0.0
+        self.stale = self.stale + 1 if len(self.history) > 0 and novelty < self.min_novelty else 0
+
+        self.history.append(sh)
+        self.history = self.history[-self.window:]
+
+        if self.repeats >= self.patience:
+            if period == 1:
+                return f"The {self.name} repeated itself for {self.repeats} steps."
+            return f"The {self.name} cycled with a period of {period} steps for {self.repeats} steps."
+        if self.stale >= self.patience:
+            return f"The {self.name} made no progress for {self.stale} steps (novelty {novelty:.2f} < {self.min_novelty})."
+        return None
@@ -0,0 +1,170 @@
+"""Streamed structured outputs: yield the items of a list field as soon as their JSON objects are complete.
+
+Streaming is provided per request lib, like the chat completion functions of CodeLinker. A stream function has the
+signature `(*, config, **kwargs)` and yields the text chunks of the tool call arguments.
+Request libs without a stream function fall back to a normal `exec`. If `stream_usage` is set, a stream function
+adds the token usage of its request to it (e.g. for the profiler).
+"""
+from typing import AsyncIterator, Optional, Type
+from contextvars import ContextVar
+import json
+import logging
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from codelinker import CodeLinker
+from codelinker.linker import replace_refs
+
+logger = logging.getLogger()
+
+# token usage of the current streamed request
+stream_usage: ContextVar[Optional[dict]] = ContextVar("stream_usage", default=None)
+
+
+class JsonItemStream:
+    """Incremental parser of a JSON object, returns the items of its top-level array field `key` once they are complete."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        # the last string seen at the top level, i.e. the key of the next value
+        self.last_string = None
+        self.in_array = False
+        self.item_start = None
+
+    def feed(self, chunk: str) -> list[dict]:
+        self.buffer += chunk
+        items = []
+        while self.pos < len(self.buffer):
+            c = self.buffer[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = self.buffer[self.string_start + 1:self.pos]
+            elif c == '"':
+                self.in_string = True
+                self.string_start = self.pos
+            elif c == "," and self.depth == 1:
+                self.last_string = None
+            elif c in "{[":
+                self.depth += 1
+                if c == "[" and self.depth == 2 and self.last_string == self.key:
+                    self.in_array = True
+                elif c == "{" and self.in_array and self.depth == 3:
+                    self.item_start = self.pos
+            elif c in "}]":
+                if c == "}" and self.in_array and self.depth == 3 and self.item_start is not None:
+                    items.append(json.loads(self.buffer[self.item_start:self.pos + 1]))
+                    self.item_start = None
+                elif c == "]" and self.in_array and self.depth == 2:
+                    self.in_array = False
+                self.depth -= 1
+            self.pos += 1
+        return items
+
+
+async def openai_stream(*, config, **kwargs) -> AsyncIterator[str]:
+    """Stream the tool call arguments of an OpenAI chat completion, configured like `codelinker.request.openai`."""
+    from openai import AsyncOpenAI, AsyncAzureOpenAI
+
+    model_name = config.get_model_name(kwargs.pop("model", None))
+    apiconfig = config.get_apiconfig_by_model(model_name)
+    request_timeout = kwargs.pop("request_timeout", config.request.default_timeout)
+    if hasattr(apiconfig, "azure_endpoint"):
+        client = AsyncAzureOpenAI(
+            api_key=getattr(apiconfig, "api_key", None),
+            organization=getattr(apiconfig, "organization", None),
+            azure_endpoint=apiconfig.azure_endpoint,
+            api_version=getattr(apiconfig, "api_version", None),
+            timeout=request_timeout,
+        )
+    else:
+        client = AsyncOpenAI(
+            api_key=apiconfig.api_key,
+            organization=getattr(apiconfig, "organization", None),
+            base_url=getattr(apiconfig, "base_url", getattr(apiconfig, "api_base", None)),
+            timeout=request_timeout,
+        )
+    request_kwargs = apiconfig.model_dump(mode="json")
+    request_kwargs.update(kwargs)
+    for k in ["azure_endpoint", "api_version", "api_key", "organization", "base_url", "api_base", "timeout"]:
+        request_kwargs.pop(k, None)
+
+    usage = stream_usage.get()
+    if usage is not None:
+        request_kwargs["stream_options"] = {"include_usage": True}
+    stream = await client.chat.completions.create(**request_kwargs, stream=True)
+    async for chunk in stream:
+        if usage is not None and chunk.usage is not None:
+            usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + chunk.usage.prompt_tokens
+            usage["completion_tokens"] = usage.get("completion_tokens", 0) + chunk.usage.completion_tokens
+        if len(chunk.choices) == 0 or chunk.choices[0].delta.tool_calls is None:
+            continue
+        for tool_call in chunk.choices[0].delta.tool_calls:
+            if tool_call.function is not None and tool_call.function.arguments:
+                yield tool_call.function.arguments
+
+
+STREAM_LIBS = {"openai": openai_stream}
+
+
+def register_stream_lib(request_lib: str, stream_func):
+    STREAM_LIBS[request_lib] = stream_func
+
+
+async def stream_items(cl: CodeLinker, *, return_type: Type[BaseModel], key: str, item_type: Type[BaseModel],
+                       prompt: str, messages: list[dict], request_name: str,
+                       completions_kwargs: Optional[dict] = None) -> AsyncIterator[BaseModel]:
+    """Request a `return_type` object and yield the items of its `key` field as soon as each one is generated.
+
+    Falls back to `cl.exec` if the request lib cannot stream or the stream fails before the first item.
+    """
+    completions_kwargs = dict(completions_kwargs) if completions_kwargs is not None else {}
+    request_lib = completions_kwargs.pop("request_lib", cl.config.request.default_request_lib)
+    stream_func = STREAM_LIBS.get(request_lib)
+
+    emitted = 0
+    if stream_func is not None:
+        schema = TypeAdapter(return_type).json_schema()
+        schema = replace_refs(schema, schema)
+        schema.pop("$defs", None)
+        parser = JsonItemStream(key)
+        try:
+            async for chunk in stream_func(
+                    config=cl.config,
+                    messages=messages + [{"role": "user", "content": prompt}],
+                    tools=[{"type": "function", "function": {"name": request_name, "description": return_type.__doc__ or "", "parameters": schema}}],
+                    tool_choice={"type": "function", "function": {"name": request_name}},
+                    **completions_kwargs):
+                for item in parser.feed(chunk):
+                    try:
+                        item = item_type.model_validate(item)
+                    except ValidationError as e:
+                        logger.warning(f"Skip invalid streamed item of {request_name}: {e}")
+                        continue
+                    emitted += 1
+                    yield item
+            return
+        except Exception as e:
+            if emitted > 0:
+                logger.error(f"Stream of {request_name} failed after {emitted} items: {e}")
+                return
+            logger.warning(f"Stream of {request_name} failed, fallback to a normal request: {e}")
+
+    res = await cl.exec(
+        prompt=prompt,
+        return_type=return_type,
+        request_name=request_name,
+        messages=messages,
+        completions_kwargs=completions_kwargs,
+    )
+    for item in getattr(res, key):
+        yield item
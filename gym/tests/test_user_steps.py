@@ -0,0 +1,71 @@
+import os
+# must be set before gym.config is imported
+os.environ.setdefault("CODELINKER_BACKEND", "fake")
+os.environ.setdefault("VIRTUAL_CLOCK", "True")
+
+import asyncio
+import yaml
+from codelinker import EventSink
+
+from gym.components import UserAgent, EnvironmentStateManager
+from gym.config import logger, clinker
+from gym.channel import sinkChannels
+from gym.backend import install_fake_backend
+from gym.main import setup_scene, run_scene
+
+CFG_FILE = os.path.join(os.path.dirname(__file__), "..", "example.yaml")
+
+
+def load_cfg(stream_events: bool, action_times: int) -> dict:
+    with open(CFG_FILE, "r") as f:
+        cfg = yaml.safe_load(f)
+    cfg["environment"]["stream_events"] = stream_events
+    cfg["user"]["action_times"] = action_times
+    return cfg
+
+
+async def run(cfg: dict, latency: float = 0.0) -> tuple[int, int]:
+    """Run a scene, returns the number of user steps started and the activities generated."""
+    install_fake_backend(clinker, latency=latency)
+    sink = EventSink(sinkChannels=sinkChannels, logger=logger, beacon_interval=0.01)
+    env = EnvironmentStateManager(**cfg["environment"], sink=sink)
+    user = UserAgent(**cfg["user"], sink=sink)
+    user.stream_events = env.stream_events
+
+    calls = 0
+    step = user.step
+    async def counted_step():
+        nonlocal calls
+        calls += 1
+        await step()
+    user.step = counted_step
+
+    sink.init()
+    await setup_scene(sink, env)
+    await run_scene(sink, user)
+    await sink.close()
+    sink.run_scheduled_thd.cancel()
+    activities = sum(sinkChannels.activity in e.tags and e.source == "User" for e in sink.all_events)
+    return calls, activities
+
+
+def test_default_scene_steps():
+    # the first step is started by `run_scene`, then one per trigger up to `action_times`
+    calls, activities = asyncio.run(run(load_cfg(stream_events=False, action_times=3)))
+    assert calls == 4
+    assert activities == 4
+
+
+def test_skipped_trigger_counts_by_default():
+    async def main(stream_events: bool) -> int:
+        user = UserAgent(**load_cfg(stream_events, 3)["user"], sink=EventSink(sinkChannels=sinkChannels, logger=logger))
+        user.stream_events = stream_events
+        user.sink.subscriber2callcount[user.step] = 2
+        async with user.step_lock:
+            await user.step()
+        return user.sink.subscriber2callcount[user.step]
+
+    # a trigger skipped while a step is running uses up one of the `action_times` emits, as before streaming
+    assert asyncio.run(main(stream_events=False)) == 2
+    # streamed events trigger the step once per event, the skipped triggers are given back
+    assert asyncio.run(main(stream_events=True)) == 1
@@ -0,0 +1,274 @@
+"""Gym trace files.
+
+Traces are written either as JSONL, one `SEvent.model_dump()` per line, or in a compact binary format if the file
+name ends with `.trace` (`TRACE_FORMAT=compact` makes it the default of `gym.main`).
+
+The compact format starts with `MAGIC`, followed by length-prefixed records `kind (1 byte) | length (uint32) | payload`:
+- `S`: an interned string (a source or a tag), ids are assigned in order of appearance.
+- `T`: an interned tag set, the uint32 ids of its tags.
+- `E`: an event, `source id (uint32) | tag set id (uint32) | time length (uint16) | time | content`.
+
+On close the writer saves a side-car `<file>.idx` with the interned strings, the offset of every event and the event
+numbers of each channel, so readers can seek to the selected channels only. A missing or stale index (e.g. a trace
+still being written) is rebuilt by scanning the record headers, without decoding the contents.
+"""
+from typing import Iterable, Iterator, Optional
+import os
+import json
+import struct
+import itertools
+
+MAGIC = b"GYMTRACE\x01"
+HEADER = struct.Struct("<cI")
+EVENT = struct.Struct("<IIH")
+
+TRACE_FORMAT = os.environ.get("TRACE_FORMAT", "jsonl")
+
+
+def trace_ext() -> str:
+    return ".trace" if TRACE_FORMAT == "compact" else ".jsonl"
+
+
+def index_path(path: str) -> str:
+    return path + ".idx"
+
+
+def is_compact(path: str) -> bool:
+    if path.endswith(".trace"):
+        return True
+    if not os.path.exists(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class TraceReader:
+    """Random access to the events of a compact trace."""
+
+    def __init__(self, path: str, load: bool = True):
+        self.path = path
+        self.strings: list[str] = []
+        self.tagsets: list[list[int]] = []
+        self.offsets: list[int] = []
+        self.channels: dict[str, list[int]] = {}
+        # end of the last complete record
+        self.size = len(MAGIC)
+        if load and not self.load_index():
+            self.scan()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def load_index(self) -> bool:
+        if not os.path.exists(index_path(self.path)):
+            return False
+        with open(index_path(self.path), "r") as f:
+            index = json.load(f)
+        if index["size"] != os.path.getsize(self.path):
+            return False
+        self.strings = index["strings"]
+        self.tagsets = index["tagsets"]
+        self.offsets = index["offsets"]
+        self.channels = index["channels"]
+        self.size = index["size"]
+        return True
+
+    def index(self) -> dict:
+        return {"size": self.size, "strings": self.strings, "tagsets": self.tagsets,
+                "offsets": self.offsets, "channels": self.channels}
+
+    def add_event(self, offset: int, tagset: int):
+        num = len(self.offsets)
+        self.offsets.append(offset)
+        for sid in self.tagsets[tagset]:
+            self.channels.setdefault(self.strings[sid], []).append(num)
+
+    def scan(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a compact trace.")
+            offset = len(MAGIC)
+            file_size = os.fstat(f.fileno()).st_size
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                kind, length = HEADER.unpack(header)
+                if kind == b"E":
+                    head = f.read(EVENT.size)
+                    if len(head) < EVENT.size:
+                        break
+                    _, tagset, _ = EVENT.unpack(head)
+                    if offset + HEADER.size + length > file_size:
+                        break
+                    f.seek(length - EVENT.size, os.SEEK_CUR)
+                    self.add_event(offset, tagset)
+                else:
+                    payload = f.read(length)
+                    if len(payload) < length:
+                        break
+                    if kind == b"S":
+                        self.strings.append(payload.decode("utf-8"))
+                    elif kind == b"T":
+                        self.tagsets.append(list(struct.unpack(f"<{length // 4}I", payload)))
+                    else:
+                        raise ValueError(f"Unknown record {kind} at {offset} of {self.path}.")
+                offset += HEADER.size + length
+                self.size = offset
+
+    def select(self, channels: Optional[Iterable[str]] = None, start: int = 0, stop: Optional[int] = None) -> list[int]:
+        """Event numbers in `[start, stop)` that have any of the `channels`."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        if channels is None:
+            return list(range(start, stop))
+        selected = set()
+        for channel in channels:
+            selected.update(self.channels.get(channel, []))
+        return sorted(num for num in selected if start <= num < stop)
+
+    def read(self, channels: Optional[Iterable[str]] = None, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+        with open(self.path, "rb") as f:
+            for num in self.select(channels, start, stop):
+                if f.tell() != self.offsets[num]:
+                    f.seek(self.offsets[num])
+                _, length = HEADER.unpack(f.read(HEADER.size))
+                payload = f.read(length)
+                source, tagset, time_length = EVENT.unpack_from(payload)
+                time_end = EVENT.size + time_length
+                yield {
+                    "source": self.strings[source],
+                    "time": payload[EVENT.size:time_end].decode("utf-8"),
+                    "tags": [self.strings[sid] for sid in self.tagsets[tagset]],
+                    "content": payload[time_end:].decode("utf-8"),
+                }
+
+
+class TraceWriter:
+    """Append events to a compact trace, see the module docstring for the layout."""
+
+    def __init__(self, path: str, mode: str = "w"):
+        self.path = path
+        if mode == "a" and os.path.exists(path) and os.path.getsize(path) > 0:
+            self.reader = TraceReader(path)
+            # drop a partially written record
+            os.truncate(path, self.reader.size)
+            self.f = open(path, "ab")
+        else:
+            # the writer keeps the index of the events written so far
+            self.reader = TraceReader(path, load=False)
+            self.f = open(path, "xb" if mode == "x" else "wb")
+            self.f.write(MAGIC)
+        self.string_ids = {s: i for i, s in enumerate(self.reader.strings)}
+        self.tagset_ids = {tuple(t): i for i, t in enumerate(self.reader.tagsets)}
+
+    def record(self, kind: bytes, payload: bytes):
+        self.f.write(HEADER.pack(kind, len(payload)))
+        self.f.write(payload)
+        self.reader.size += HEADER.size + len(payload)
+
+    def intern(self, s: str) -> int:
+        if s not in self.string_ids:
+            self.string_ids[s] = len(self.reader.strings)
+            self.reader.strings.append(s)
+            self.record(b"S", s.encode("utf-8"))
+        return self.string_ids[s]
+
+    def intern_tags(self, tags: list[str]) -> int:
+        key = tuple(self.intern(str(tag)) for tag in tags)
+        if key not in self.tagset_ids:
+            self.tagset_ids[key] = len(self.reader.tagsets)
+            self.reader.tagsets.append(list(key))
+            self.record(b"T", struct.pack(f"<{len(key)}I", *key))
+        return self.tagset_ids[key]
+
+    def write(self, event: dict):
+        source = self.intern(event["source"])
+        tagset = self.intern_tags(event["tags"])
+        time = event["time"].encode("utf-8")
+        offset = self.reader.size
+        self.record(b"E", EVENT.pack(source, tagset, len(time)) + time + event["content"].encode("utf-8"))
+        self.reader.add_event(offset, tagset)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+        tmp_path = index_path(self.path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.reader.index(), f)
+        os.replace(tmp_path, index_path(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonlTraceWriter:
+    def __init__(self, path: str, mode: str = "w"):
+        self.f = open(path, mode)
+
+    def write(self, event: dict):
+        self.f.write(json.dumps(event) + "\n")
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_trace(path: str, mode: str = "w") -> TraceWriter | JsonlTraceWriter:
+    """Open a trace for writing, in the compact format if `path` ends with `.trace` or is an existing compact trace."""
+    if is_compact(path):
+        return TraceWriter(path, mode)
+    return JsonlTraceWriter(path, mode)
+
+
+def read_trace(path: str, channels: Optional[Iterable[str]] = None, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+    """Stream the events `[start, stop)` of a trace, only those with any of the `channels` if given."""
+    if is_compact(path):
+        yield from TraceReader(path).read(channels, start, stop)
+        return
+    channels = set(channels) if channels is not None else None
+    with open(path, "r") as f:
+        for line in itertools.islice(f, start, stop):
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if channels is None or any(tag in channels for tag in event["tags"]):
+                yield event
+
+
+def truncate_trace(path: str, num_events: int):
+    """Keep the first `num_events` events of a trace, raise if it has fewer."""
+    if is_compact(path):
+        reader = TraceReader(path)
+        if len(reader) < num_events:
+            raise ValueError(f"Trace {path} has {len(reader)} events, but {num_events} are expected.")
+        size = reader.offsets[num_events] if num_events < len(reader) else reader.size
+        os.truncate(path, size)
+        if os.path.exists(index_path(path)):
+            os.remove(index_path(path))
+        return
+
+    count = 0
+    tmp_path = path + ".tmp"
+    with open(path, "r") as f, open(tmp_path, "w") as out:
+        for line in f:
+            if count >= num_events:
+                break
+            out.write(line)
+            count += 1
+    if count < num_events:
+        os.remove(tmp_path)
+        raise ValueError(f"Trace {path} has {count} events, but {num_events} are expected.")
+    os.replace(tmp_path, path)
@@ -0,0 +1,33 @@
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger()
+
+_encoder = None
+
+
+def get_encoder():
+    """Load the tiktoken encoder once, return `False` if it is not available (e.g. offline)."""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"Failed to load tiktoken encoder, fallback to length estimation. {e}")
+            _encoder = False
+    return _encoder
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Count the prompt tokens of a text. Estimate with 4 chars per token if tiktoken is unavailable."""
+    encoder = get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(messages: list[dict]) -> int:
+    """Count the prompt tokens of chat messages."""
+    return sum(count_tokens(msg["content"]) for msg in messages if isinstance(msg["content"], str))